@@ -1,5 +1,9 @@
+import jieba
 import streamlit as st
 
+# Start loading the jieba dictionary while the user picks a language
+jieba.initialize(background=True)
+
 st.markdown("""
 
 # AI模型輔助語言學習 
@@ -0,0 +1,102 @@
+"""Throughput of Tokenizer.get_DAG with the prefix and the automaton matcher.
+
+Builds the DAG of every block that `Tokenizer.cut` would hand to it, for the
+Little Prince text of the Mandarin page (repeated) and for a synthetic corpus of random
+dictionary words mixed with random Han characters and punctuation, and
+reports characters per second for each (backend, matcher) pair together with
+the time of a whole `lcut(HMM=False)`. The DAGs of all pairs are checked to
+be identical before timing.
+"""
+import argparse
+import ast
+import io
+import random
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+CONFIGS = (("dict", "prefix"), ("trie", "prefix"), ("trie", "automaton"))
+PUNCTUATION = "，。、；：？！「」（）\n "
+
+
+def little_prince():
+    source = (ROOT / "pages" / "01_\U0001f34aMandarin.py").read_text(encoding="utf-8")
+    for node in ast.parse(source).body:
+        if isinstance(node, ast.Assign) and getattr(node.targets[0], "id", None) == "DEFAULT_TEXT":
+            return ast.literal_eval(node.value)
+    raise RuntimeError("DEFAULT_TEXT not found")
+
+
+def synthetic(chars, seed=0):
+    rnd = random.Random(seed)
+    with io.open(str(ROOT / "jieba" / "dict.txt"), encoding="utf-8") as f:
+        words = [line.split(" ", 1)[0] for line in f]
+    parts = []
+    size = 0
+    while size < chars:
+        r = rnd.random()
+        if r < 0.7:
+            part = rnd.choice(words)
+        elif r < 0.85:
+            part = "".join(chr(rnd.randint(0x4E00, 0x9FD5)) for _ in range(rnd.randint(1, 4)))
+        else:
+            part = rnd.choice(PUNCTUATION)
+        parts.append(part)
+        size += len(part)
+    return "".join(parts)
+
+
+def blocks(text):
+    import jieba
+    return [blk for blk in jieba.re_han_default.split(text)
+            if blk and jieba.re_han_default.match(blk)]
+
+
+def best_of(repeat, func, *args):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chars", type=int, default=2000000,
+                        help="size of the synthetic corpus in characters")
+    parser.add_argument("--copies", type=int, default=200,
+                        help="copies of the Little Prince text to segment")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    import jieba
+
+    jieba.setLogLevel(60)
+    tokenizers = []
+    for backend, matcher in CONFIGS:
+        tokenizer = jieba.Tokenizer(backend=backend, matcher=matcher)
+        tokenizer.initialize()
+        tokenizers.append(tokenizer)
+
+    for name, text in (("little prince x%d" % args.copies, little_prince() * args.copies),
+                       ("synthetic", synthetic(args.chars))):
+        text_blocks = blocks(text)
+        block_chars = sum(map(len, text_blocks))
+        reference = [tokenizers[0].get_DAG(blk) for blk in text_blocks]
+        for tokenizer in tokenizers[1:]:
+            if [tokenizer.get_DAG(blk) for blk in text_blocks] != reference:
+                raise SystemExit("DAG mismatch: %r" % tokenizer)
+        print("%s: %d characters, %d blocks" % (name, len(text), len(text_blocks)))
+        print("  %-7s %-10s %14s %12s" % ("backend", "matcher", "get_DAG chars/s", "lcut s"))
+        for (backend, matcher), tokenizer in zip(CONFIGS, tokenizers):
+            dag = best_of(args.repeat, lambda: [tokenizer.get_DAG(blk) for blk in text_blocks])
+            cut = best_of(args.repeat, tokenizer.lcut, text, False, False)
+            print("  %-7s %-10s %14.0f %12.3f" % (backend, matcher, block_chars / dag, cut))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Speed of the finalseg Viterbi decoders on out-of-vocabulary text.
+
+Builds buffers of the kind Tokenizer.cut hands to finalseg: runs of
+personal names (a surname and one or two given-name characters) and
+transliterated foreign names, which the dictionary does not know. Decodes
+them with the path-copying decoder of jieba 0.38 (kept here as the
+reference), with finalseg.viterbi and with finalseg.viterbi_batch (numpy,
+if installed), checks that all agree and reports characters per second.
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+SURNAMES = "王李張劉陳楊黃趙吳周徐孫馬朱胡郭何高林羅鄭梁謝宋唐許韓馮鄧曹彭曾蕭田董潘袁蔡蔣余"
+GIVEN = "偉芳娜敏靜麗強磊軍洋勇艷傑娟濤明超秀霞平剛桂英華玉蘭萍紅建文輝志"
+TRANSLIT = "克里斯托弗約翰史密斯威廉姆森亞歷山大瑪麗安娜伊莎貝拉卡爾維諾薩塔德"
+
+
+def oov_buffers(count, seed=0):
+    rnd = random.Random(seed)
+    buffers = []
+    for _ in range(count):
+        parts = []
+        for _ in range(rnd.randint(1, 4)):
+            if rnd.random() < 0.5:
+                parts.append(rnd.choice(SURNAMES) + "".join(
+                    rnd.choice(GIVEN) for _ in range(rnd.randint(1, 2))))
+            else:
+                parts.append("".join(rnd.choice(TRANSLIT) for _ in range(rnd.randint(3, 6))))
+        buffers.append("".join(parts))
+    return buffers
+
+
+def path_copying_viterbi(obs, states, start_p, trans_p, emit_p):
+    from jieba.finalseg import MIN_FLOAT, PrevStatus
+
+    V = [{}]
+    path = {}
+    for y in states:
+        V[0][y] = start_p[y] + emit_p[y].get(obs[0], MIN_FLOAT)
+        path[y] = [y]
+    for t in range(1, len(obs)):
+        V.append({})
+        newpath = {}
+        for y in states:
+            em_p = emit_p[y].get(obs[t], MIN_FLOAT)
+            (prob, state) = max(
+                [(V[t - 1][y0] + trans_p[y0].get(y, MIN_FLOAT) + em_p, y0) for y0 in PrevStatus[y]])
+            V[t][y] = prob
+            newpath[y] = path[state] + [y]
+        path = newpath
+    (prob, state) = max((V[len(obs) - 1][y], y) for y in "ES")
+    return (prob, path[state])
+
+
+def best_of(repeat, func):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--buffers", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    from jieba import finalseg
+
+    finalseg.check_model_loaded()
+    model = (finalseg.start_P, finalseg.trans_P, finalseg.emit_P)
+    buffers = oov_buffers(args.buffers)
+    chars = sum(map(len, buffers))
+
+    runs = [
+        ("path copying (0.38)", lambda: ["".join(path_copying_viterbi(b, "BMES", *model)[1])
+                                         for b in buffers]),
+        ("viterbi", lambda: ["".join(finalseg.viterbi(b, "BMES", *model)[1]) for b in buffers]),
+    ]
+    if finalseg._import_numpy() is not None:
+        runs.append(("viterbi_batch (numpy)", lambda: finalseg.viterbi_batch(buffers)))
+    else:
+        print("numpy is not installed, skipping viterbi_batch", file=sys.stderr)
+
+    print("%d buffers, %d characters" % (len(buffers), chars))
+    reference = None
+    for name, func in runs:
+        elapsed, states = best_of(args.repeat, func)
+        if reference is None:
+            reference, base = states, elapsed
+        elif states != reference:
+            raise SystemExit("%s disagrees with the reference decoder" % name)
+        print("  %-22s %12.0f chars/s %6.2fx" % (name, chars / elapsed, base / elapsed))
+
+
+if __name__ == "__main__":
+    main()
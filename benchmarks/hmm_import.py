@@ -0,0 +1,96 @@
+"""Time to import jieba and to load the HMM tables of finalseg and posseg.
+
+Each measurement runs in a fresh interpreter, best of --repeat. The first
+one only imports jieba, as a caller who never runs the HMM does. The tables
+are loaded from the shipped hmm.bin files (copied into dicts, as
+check_model_loaded does, or read in place through memory-mapped views, as
+attach_model does) and from the prob_*.py modules, both with their cached
+bytecode and compiled from source, as on a first run or a read-only
+install. Also reports the peak resident set size of each process where the
+resource module is available.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+CHILD = """
+import sys, time, json
+sys.path.insert(0, %(root)r)
+start = time.perf_counter()
+import jieba
+imported = time.perf_counter()
+mode = %(mode)r
+packages = ()
+if mode != 'none':
+    from jieba import finalseg, posseg, _tables
+    packages = (finalseg, posseg)
+for package in packages:
+    name = package.__name__.rsplit('.', 1)[1]
+    path = package.__file__.rsplit('__init__', 1)[0] + _tables.TABLE_FILE
+    if mode == 'binary':
+        package.check_model_loaded()
+    elif mode == 'views':
+        package.attach_model(path)
+    else:
+        tables = _tables.load_sources(name)
+        if name == 'posseg':
+            tables = tables[-1:] + tables[:-1]
+        package.set_model(*tables)
+loaded = time.perf_counter()
+try:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024
+except ImportError:
+    rss = None
+print(json.dumps({'import': imported - start, 'load': loaded - imported, 'rss_kib': rss}))
+"""
+
+MODES = [
+    ("none", "not loaded", {}),
+    ("binary", "hmm.bin, copied", {}),
+    ("views", "hmm.bin, mapped views", {}),
+    ("modules", "prob_*.py, cached bytecode", {}),
+    ("compile", "prob_*.py, from source", {"PYTHONDONTWRITEBYTECODE": "1"}),
+]
+
+
+def run_child(mode, env):
+    code = CHILD % {"root": str(ROOT), "mode": "modules" if mode == "compile" else mode}
+    out = subprocess.check_output([sys.executable, "-c", code], env=env)
+    return json.loads(out.decode("utf-8").strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    prefix = tempfile.mkdtemp(prefix="jieba-pycache-")
+    try:
+        print("%-30s %10s %10s %10s" % ("tables", "import s", "load s", "peak KiB"))
+        for mode, label, extra in MODES:
+            env = dict(os.environ, **extra)
+            if mode == "compile":
+                # an empty bytecode cache that is never written to
+                env["PYTHONPYCACHEPREFIX"] = prefix
+            else:
+                run_child(mode, env)  # warm up the bytecode and page caches
+            runs = [run_child(mode, env) for _ in range(args.repeat)]
+            best = min(runs, key=lambda r: r["import"] + r["load"])
+            rss = "%10d" % best["rss_kib"] if best["rss_kib"] is not None else "%10s" % "-"
+            print("%-30s %10.4f %10.4f %s" % (label, best["import"], best["load"], rss))
+    finally:
+        shutil.rmtree(prefix, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
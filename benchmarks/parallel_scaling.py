@@ -0,0 +1,63 @@
+"""Throughput of ParallelTokenizer for increasing numbers of worker processes.
+
+Segments a synthetic corpus (see dag_matchers.py) once with the tokenizer
+itself and then with ParallelTokenizer for 1, 2, 4, ... workers up to the
+number of CPUs, both as one long text and as a batch of short documents,
+and reports characters per second and the speedup over the single process.
+The time to publish the tables and start the pool is excluded.
+"""
+import argparse
+import multiprocessing
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dag_matchers import synthetic
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chars", type=int, default=2000000)
+    parser.add_argument("--docs", type=int, default=5000,
+                        help="number of documents the corpus is split into for the batch run")
+    parser.add_argument("--chunk-chars", type=int, default=65536)
+    parser.add_argument("--max-workers", type=int, default=multiprocessing.cpu_count())
+    args = parser.parse_args()
+
+    import jieba
+
+    jieba.setLogLevel(60)
+    jieba.initialize()
+    jieba.wait_cache_written()
+    text = synthetic(args.chars)
+    step = len(text) // args.docs + 1
+    docs = [text[i:i + step] for i in range(0, len(text), step)]
+
+    serial, expected = timed(jieba.lcut, text)
+    print("cpus: %d, corpus: %d characters, %d documents" % (
+        multiprocessing.cpu_count(), len(text), len(docs)))
+    print("%-8s %14s %8s %14s %8s" % ("workers", "text chars/s", "speedup", "batch chars/s", "speedup"))
+    print("%-8s %14.0f %8.2f %14s %8s" % ("serial", len(text) / serial, 1.0, "", ""))
+    workers = 1
+    while workers <= args.max_workers:
+        with jieba.ParallelTokenizer(processnum=workers, chunk_chars=args.chunk_chars) as parallel:
+            parallel.start()
+            elapsed, words = timed(parallel.lcut, text)
+            if words != expected:
+                raise SystemExit("result mismatch with %d workers" % workers)
+            batch, _ = timed(lambda: list(parallel.cut_batch(docs)))
+        print("%-8d %14.0f %8.2f %14.0f %8.2f" % (
+            workers, len(text) / elapsed, serial / elapsed, len(text) / batch, serial / batch))
+        workers *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Resident memory of extra worker processes with private vs. shared jieba tables.
+
+Starts N worker processes (spawned, so nothing is inherited from the parent)
+that each load jieba with POS tagging and segment a sample text, either by
+building their own dictionary, POS tag table and HMM tables ("private") or by
+attaching to a directory written once by POSTokenizer.publish ("shared").
+All workers of a mode stay alive until every one of them has reported, so
+that shared pages are split between them in the proportional set size (PSS).
+The words and tags of every worker are checked against those of the parent.
+
+Linux only, since it reads /proc/self/smaps_rollup.
+"""
+import argparse
+import multiprocessing
+import queue
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# seconds to wait for a worker to load jieba and report
+TIMEOUT = 300
+
+SAMPLE = "我在撒哈拉沙漠飛機故障的時候，遇到了一位奇異的小王子。他請我給他畫一隻綿羊。"
+
+
+def memory_kb():
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    private = fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+    return fields.get("Rss", 0), fields.get("Pss", 0), private
+
+
+def worker(mode, shared_dir, results, done):
+    import jieba
+    import jieba.posseg
+
+    jieba.setLogLevel(60)
+    if mode == "private":
+        postokenizer = jieba.posseg.POSTokenizer(jieba.Tokenizer(backend="dict"))
+    else:
+        postokenizer = jieba.posseg.POSTokenizer(jieba.Tokenizer(backend="trie"))
+        postokenizer.attach(shared_dir)
+    # the private tokenizer is not loaded yet: lcut has to load it first
+    tagged = [tuple(p) for p in postokenizer.lcut(SAMPLE)]
+    results.put((memory_kb(), tagged))
+    done.wait()
+
+
+def collect(mode, procs, results, timeout):
+    """The reports of all workers, failing if one dies or they take too long."""
+    deadline = time.monotonic() + timeout
+    reports = []
+    while len(reports) < len(procs):
+        try:
+            reports.append(results.get(timeout=1))
+            continue
+        except queue.Empty:
+            pass
+        # a worker that died never reports
+        failed = [p.exitcode for p in procs if p.exitcode]
+        if failed or time.monotonic() > deadline:
+            for p in procs:
+                p.terminate()
+            raise SystemExit("%s worker %s" % (
+                mode, "exited with status %d" % failed[0] if failed else "timed out"))
+    return reports
+
+
+def run(mode, workers, shared_dir, reference, timeout):
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    done = ctx.Event()
+    procs = [ctx.Process(target=worker, args=(mode, shared_dir, results, done))
+             for _ in range(workers)]
+    for p in procs:
+        p.start()
+    reports = collect(mode, procs, results, timeout)
+    done.set()
+    for p in procs:
+        p.join()
+    for stats, tagged in reports:
+        if tagged != reference:
+            raise SystemExit("%s worker disagrees with the parent: %r" % (mode, tagged))
+    return [stats for stats, tagged in reports]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--workers", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=TIMEOUT,
+                        help="seconds to wait for the workers of a mode")
+    args = parser.parse_args()
+
+    import jieba
+    import jieba.posseg
+
+    jieba.setLogLevel(60)
+    shared_dir = tempfile.mkdtemp(prefix="jieba-shared-")
+    try:
+        jieba.posseg.dt.publish(shared_dir)
+        reference = [tuple(p) for p in jieba.posseg.lcut(SAMPLE)]
+        print("%-8s %8s %8s %8s   (MiB per worker, mean of %d)"
+              % ("mode", "RSS", "PSS", "private", args.workers))
+        for mode in ("private", "shared"):
+            stats = run(mode, args.workers, shared_dir, reference, args.timeout)
+            rss, pss, private = [sum(col) / len(stats) / 1024.0 for col in zip(*stats)]
+            print("%-8s %8.1f %8.1f %8.1f" % (mode, rss, pss, private))
+    finally:
+        shutil.rmtree(shared_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""Benchmark suite for jieba segmentation, POS tagging, keyword extraction and loading.
+
+Runs every benchmark on every corpus and reports characters per second
+(best of --repeat runs, fewer if a benchmark has used up --budget seconds)
+and the peak of Python allocations during one more run, traced with
+tracemalloc (memory-mapped dictionaries are not counted). The corpora are
+the Little Prince text of the Mandarin page (repeated), the TOCFL word list
+one word per line, and a synthetic corpus (see dag_matchers.py). Loading
+the dictionary is measured cold, from an empty cache directory, and warm,
+from the cache, in dictionary characters per second. A cold start with the
+default "dict" backend returns before the cache is written, on a thread;
+init/cold_written waits for it too.
+
+The sentence caches of jieba.finalseg and jieba.posseg are disabled, so
+that repeated runs, and the repeated sentences of the Little Prince corpus,
+are segmented again instead of being looked up, and their HMM tables are
+loaded before the first benchmark rather than during it.
+
+    python benchmarks/suite.py --save baseline.json
+    python benchmarks/suite.py --compare baseline.json --threshold 0.1 --threshold posseg.cut=0.25
+
+With --compare, a benchmark whose throughput dropped by more than its
+threshold (a fraction, the default one or NAME=FRACTION, NAME being the
+benchmark with or without its corpus) is reported and the exit status is 1.
+The keyword extraction benchmarks are skipped if jieba/analyse/idf.txt is
+missing, since jieba.analyse cannot be imported without it.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from dag_matchers import little_prince, synthetic
+
+
+def tocfl_words():
+    with io.open(str(ROOT / "tocfl_wordlist.csv"), encoding="utf-8", newline="") as f:
+        return "\n".join(row["詞彙"] for row in csv.DictReader(f))
+
+
+def segmentation_benchmarks():
+    import jieba
+    import jieba.posseg
+
+    benchmarks = [
+        ("cut", lambda text: jieba.lcut(text)),
+        ("cut_all", lambda text: jieba.lcut(text, cut_all=True)),
+        ("cut_no_hmm", lambda text: jieba.lcut(text, HMM=False)),
+        ("cut_for_search", lambda text: jieba.lcut_for_search(text)),
+        ("tokenize", lambda text: list(jieba.tokenize(text))),
+        ("posseg.cut", lambda text: jieba.posseg.lcut(text)),
+    ]
+    if (ROOT / "jieba" / "analyse" / "idf.txt").is_file():
+        import jieba.analyse
+
+        benchmarks += [
+            ("extract_tags", lambda text: jieba.analyse.extract_tags(text)),
+            ("textrank", lambda text: jieba.analyse.textrank(text)),
+        ]
+    else:
+        print("jieba/analyse/idf.txt not found, skipping extract_tags and textrank",
+              file=sys.stderr)
+    return benchmarks
+
+
+def measure(func, arg, chars, repeat, budget, setup=None):
+    best = float("inf")
+    spent = 0.0
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func(arg)
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        spent += elapsed
+        if spent >= budget:
+            break
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        func(arg)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"chars": chars, "seconds": best, "chars_per_sec": chars / best,
+            "peak_kib": peak // 1024}
+
+
+def run(args):
+    import jieba
+    import jieba.finalseg
+    import jieba.posseg
+
+    jieba.setLogLevel(60)
+    results = {}
+
+    dict_chars = len((ROOT / "jieba" / "dict.txt").read_text(encoding="utf-8"))
+    cache_dir = tempfile.mkdtemp(prefix="jieba-bench-")
+
+    loaded = []
+
+    def load(_):
+        tokenizer = jieba.Tokenizer()
+        tokenizer.tmp_dir = cache_dir
+        tokenizer.initialize()
+        loaded.append(tokenizer)
+
+    def load_written(_):
+        load(None)
+        loaded[-1].wait_cache_written()
+
+    def empty():
+        # the cache of the previous run may still be being written
+        for tokenizer in loaded:
+            tokenizer.wait_cache_written()
+        for name in os.listdir(cache_dir):
+            os.remove(os.path.join(cache_dir, name))
+
+    try:
+        results["init/cold"] = measure(load, None, dict_chars, args.repeat, args.budget,
+                                       setup=empty)
+        results["init/cold_written"] = measure(load_written, None, dict_chars, args.repeat,
+                                               args.budget, setup=empty)
+        results["init/warm"] = measure(load, None, dict_chars, args.repeat, args.budget)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    jieba.initialize()
+    jieba.wait_cache_written()
+    for package in (jieba.finalseg, jieba.posseg):
+        package.set_cache_size(0)
+        package.check_model_loaded()
+    corpora = [
+        ("little_prince", little_prince() * args.copies),
+        ("tocfl", tocfl_words()),
+        ("synthetic", synthetic(args.chars)),
+    ]
+    benchmarks = segmentation_benchmarks()
+    for corpus, text in corpora:
+        for name, func in benchmarks:
+            results["%s/%s" % (name, corpus)] = measure(
+                func, text, len(text), args.repeat, args.budget)
+    return results
+
+
+def environment():
+    import jieba
+
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "jieba": jieba.__version__, "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def parse_thresholds(values):
+    default = 0.1
+    overrides = {}
+    for value in values:
+        name, sep, fraction = value.rpartition("=")
+        if sep:
+            overrides[name] = float(fraction)
+        else:
+            default = float(fraction)
+    return default, overrides
+
+
+def compare(results, baseline, thresholds):
+    default, overrides = thresholds
+    regressions = []
+    for key, result in sorted(results.items()):
+        if key not in baseline:
+            continue
+        threshold = overrides.get(key, overrides.get(key.split("/")[0], default))
+        before = baseline[key]["chars_per_sec"]
+        change = result["chars_per_sec"] / before - 1
+        flag = ""
+        if change < -threshold:
+            flag = "REGRESSION"
+            regressions.append(key)
+        print("%-30s %14.0f %14.0f %+8.1f%% %s" % (key, before, result["chars_per_sec"],
+                                                  100 * change, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chars", type=int, default=50000,
+                        help="size of the synthetic corpus in characters")
+    parser.add_argument("--copies", type=int, default=50,
+                        help="copies of the Little Prince text to segment")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--budget", type=float, default=10.0,
+                        help="seconds after which a benchmark is not repeated")
+    parser.add_argument("--save", metavar="JSON", help="write the results as a baseline")
+    parser.add_argument("--compare", metavar="JSON", help="compare with a saved baseline")
+    parser.add_argument("--threshold", action="append", default=[],
+                        metavar="[NAME=]FRACTION",
+                        help="allowed drop in throughput, 0.1 by default")
+    args = parser.parse_args()
+    thresholds = parse_thresholds(args.threshold)
+
+    results = run(args)
+    print("%-30s %14s %10s %12s" % ("benchmark", "chars/s", "seconds", "peak KiB"))
+    for key, result in sorted(results.items()):
+        print("%-30s %14.0f %10.4f %12d" % (key, result["chars_per_sec"], result["seconds"],
+                                           result["peak_kib"]))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"environment": environment(), "results": results}, f, indent=2,
+                      sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        print()
+        print("%-30s %14s %14s %9s" % ("benchmark", "baseline", "current", "change"))
+        if compare(results, baseline, thresholds):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Time to load a large user dictionary with and without the bulk path.
+
+Writes a synthetic user dictionary of compounds of two dictionary words,
+half of them without a frequency (so that one has to be suggested) and
+some with a POS tag, then loads it into a fresh Tokenizer with
+load_userdict() and with load_userdict(bulk=True), and reports the
+seconds each took. Only parsing and merging are measured: compiling the
+merged dictionary is turned off, and the caches are written to a temporary
+directory removed afterwards, so that no run finds a cache of an earlier one.
+"""
+import argparse
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+TAGS = ("n", "nz", "v", "ns")
+
+
+def write_userdict(path, entries, seed=0):
+    rnd = random.Random(seed)
+    with io.open(str(ROOT / "jieba" / "dict.txt"), encoding="utf-8") as f:
+        words = [line.split(" ", 1)[0] for line in f]
+    with io.open(path, "w", encoding="utf-8") as f:
+        for _ in range(entries):
+            line = rnd.choice(words) + rnd.choice(words)
+            if rnd.random() < 0.5:
+                line += " %d" % rnd.randint(1, 1000)
+            if rnd.random() < 0.3:
+                line += " " + rnd.choice(TAGS)
+            f.write(line + "\n")
+
+
+def load(backend, path, bulk, tmp_dir):
+    import jieba
+
+    tokenizer = jieba.Tokenizer(backend=backend)
+    tokenizer.tmp_dir = tmp_dir
+    tokenizer.initialize()
+    # not while the "dict" backend is still writing the dictionary cache
+    tokenizer.wait_cache_written()
+    start = time.perf_counter()
+    tokenizer.load_userdict(path, bulk=bulk)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=200000)
+    parser.add_argument("--backend", default="dict", choices=("dict", "trie"))
+    args = parser.parse_args()
+
+    import jieba
+
+    jieba.setLogLevel(60)
+    jieba.USERDICT_COMPILE_MIN = float("inf")
+    tmp = tempfile.mkdtemp(prefix="jieba-userdict-")
+    path = os.path.join(tmp, "userdict.txt")
+    try:
+        write_userdict(path, args.entries)
+        sequential = load(args.backend, path, False, tmp)
+        bulk = load(args.backend, path, True, tmp)
+        print("%d entries, %s backend" % (args.entries, args.backend))
+        print("  load_userdict            %8.2f s" % sequential)
+        print("  load_userdict(bulk=True) %8.2f s" % bulk)
+        print("  speedup                  %8.1fx" % (sequential / bulk))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
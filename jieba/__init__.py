@@ -5,15 +5,25 @@ __license__ = 'MIT'
 import re
 import os
 import sys
+import mmap
+import codecs
+import io
 import time
 import logging
-import marshal
 import tempfile
+import importlib
 import threading
+from array import array
+from contextlib import contextmanager
 from math import log
 from hashlib import md5
 from ._compat import *
-from . import finalseg
+from ._trie import CompactTrie, TrieFreq, TrieTags, COMPACT_MIN
+from ._lru import LRUCache
+from ._filelock import FileLock
+from ._profile import Profiler, timer
+from ._parallel import ParallelTokenizer
+from . import _trie
 
 if os.name == 'nt':
     from shutil import move as _replace_file
@@ -25,6 +35,10 @@ _get_abs_path = lambda path: os.path.normpath(os.path.join(os.getcwd(), path))
 DEFAULT_DICT = None
 DEFAULT_DICT_NAME = "dict.txt"
 
+# file names inside a directory written by Tokenizer.publish
+SHARED_DICT = "dict.bin"
+SHARED_HMM = "finalseg.bin"
+
 log_console = logging.StreamHandler(sys.stderr)
 default_logger = logging.getLogger(__name__)
 default_logger.setLevel(logging.DEBUG)
@@ -32,6 +46,20 @@ default_logger.addHandler(log_console)
 
 DICT_WRITING = {}
 
+DICT_BACKENDS = ('dict', 'trie')
+
+DAG_MATCHERS = ('prefix', 'automaton')
+
+# lines a user dictionary needs for load_userdict to compile the merged
+# dictionary to a cache file, and compiled files kept per cache directory
+USERDICT_COMPILE_MIN = 50000
+USERDICT_CACHE_FILES = 4
+
+# distinct unknown runs cut by the HMM together, and words held back waiting
+# for them at most, in accurate mode
+HMM_BATCH = 256
+HMM_PENDING = 8192
+
 pool = None
 
 re_userdict = re.compile('^(.+?)( [0-9]+)?( [a-z]+)?$', re.U)
@@ -42,42 +70,374 @@ re_eng = re.compile('[a-zA-Z0-9]', re.U)
 # \r\n|\s : whitespace characters. Will not be handled.
 re_han_default = re.compile("([\u4E00-\u9FD5a-zA-Z0-9+#&\._]+)", re.U)
 re_skip_default = re.compile("(\r\n|\s)", re.U)
+re_han_pair = re.compile("[\u4E00-\u9FD5a-zA-Z0-9+#&\._]{2}$", re.U)
 re_han_cut_all = re.compile("([\u4E00-\u9FD5]+)", re.U)
 re_skip_cut_all = re.compile("[^a-zA-Z0-9+#\n]", re.U)
 
+# Single pass scanners classifying a text into spans by the group that
+# matched (`match.lastindex`): the blocks of re_han_default, the separators
+# of re_skip_default and the runs of other characters for accurate mode;
+# the blocks of re_han_cut_all, the runs kept by re_skip_cut_all and its
+# separators, one character each, for full mode.
+SPAN_HAN, SPAN_SKIP, SPAN_OTHER = 1, 2, 3
+SPAN_KEEP, SPAN_SEP = 2, 3
+re_scan_default = re.compile(
+    "([\u4E00-\u9FD5a-zA-Z0-9+#&\._]+)|(\r\n|\s)|([^\u4E00-\u9FD5a-zA-Z0-9+#&\._\s]+)", re.U)
+re_scan_cut_all = re.compile(
+    "([\u4E00-\u9FD5]+)|([a-zA-Z0-9+#\n]+)|([^\u4E00-\u9FD5a-zA-Z0-9+#\n])", re.U)
+
 def setLogLevel(log_level):
     global logger
     default_logger.setLevel(log_level)
 
+
+# jieba.finalseg (and numpy, which it may use) is imported by the first HMM
+# cut, publish or attach, so that callers who never run the HMM never import it
+_finalseg_module = None
+
+
+def _finalseg():
+    global _finalseg_module
+    if _finalseg_module is None:
+        # not `from . import`, which would look the name up with __getattr__
+        _finalseg_module = importlib.import_module(__name__ + '.finalseg')
+    return _finalseg_module
+
+
+def __getattr__(name):
+    # `jieba.finalseg` without importing it first, as when it was eager
+    if name == 'finalseg':
+        return _finalseg()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def _write_file(path, data):
+    # write to a temporary file first, so that readers never see a partial file
+    fd, fpath = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    _replace_file(fpath, path)
+
+def _common_prefix_len(a, b):
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _common_suffix_len(a, b, limit):
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:] == b[len(b) - mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _prune_compiled_userdicts(tmp_dir):
+    '''
+    Remove all but the USERDICT_CACHE_FILES most recently used dictionaries
+    compiled by `Tokenizer.load_userdict` from `tmp_dir`. Their lock files
+    are left in place: another process may hold a lock on one, and removing
+    it would let the next one lock a new file at the same time.
+    '''
+    try:
+        names = [name for name in os.listdir(tmp_dir)
+                 if name.startswith('jieba.m') and name.endswith('.bin')]
+        if len(names) <= USERDICT_CACHE_FILES:
+            return
+        paths = sorted((os.path.join(tmp_dir, name) for name in names),
+                       key=os.path.getmtime, reverse=True)
+    except (IOError, OSError):
+        return
+    for path in paths[USERDICT_CACHE_FILES:]:
+        default_logger.debug("Removing old user dictionary cache %s" % path)
+        try:
+            # processes that mapped the file keep reading it
+            os.remove(path)
+        except (IOError, OSError):
+            pass
+
+
+def _safe_boundary(sentence, i):
+    '''
+    Whether accurate mode cuts sentence[:i] and sentence[i:] into the same
+    words as the whole sentence: i must not fall inside a block of
+    re_han_default characters or between a carriage return and a line feed.
+    '''
+    if i <= 0 or i >= len(sentence):
+        return True
+    pair = sentence[i - 1:i + 1]
+    return pair != '\r\n' and not re_han_pair.match(pair)
+
+
+def _safe_boundary_all(sentence, i):
+    '''
+    `_safe_boundary` for full pattern, where only the boundaries of blocks
+    of Chinese characters are safe.
+    '''
+    if i <= 0 or i >= len(sentence):
+        return True
+    return (re_han_cut_all.match(sentence[i - 1]) is None) != (re_han_cut_all.match(sentence[i]) is None)
+
+
+def _read_text(source, size, encoding, use_mmap):
+    '''
+    Yield the text of a path, file object or bytes-like object (such as an
+    mmap) in pieces, decoding bytes incrementally.
+    '''
+    decoder = codecs.getincrementaldecoder(encoding)()
+    f = None
+    if isinstance(source, string_types):
+        f = open(source, 'rb')
+        if use_mmap:
+            if os.fstat(f.fileno()).st_size:
+                source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                source = b''
+        else:
+            source = f
+    try:
+        if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+            for i in xrange(0, len(source), size):
+                yield decoder.decode(source[i:i + size])
+        else:
+            while True:
+                data = source.read(size)
+                if not data:
+                    break
+                yield data if isinstance(data, text_type) else decoder.decode(data)
+        yield decoder.decode(b'', True)
+    finally:
+        if f is not None:
+            if isinstance(source, mmap.mmap):
+                source.close()
+            f.close()
+
+
+class DictSnapshot(object):
+    '''
+    One version of the dictionary of a Tokenizer: the prefix dict `FREQ`,
+    the `total` frequency and a `version` number. A published snapshot is
+    never changed again, so readers can use it without locking.
+    '''
+    __slots__ = ('FREQ', 'total', 'version')
+
+    def __init__(self, FREQ, total, version):
+        self.FREQ = FREQ
+        self.total = total
+        self.version = version
+
+    def __repr__(self):
+        return '<DictSnapshot version=%d total=%d>' % (self.version, self.total)
+
+
+class LayeredFreq(object):
+    '''
+    Prefix dict of the "dict" backend once words have been added: the
+    frequencies changed by the latest changes in `delta`, over those of
+    earlier ones in `older`, over a `base` dict. `base` and `older` are
+    never changed, and are shared by the LayeredFreqs made by `layer`.
+    '''
+    __slots__ = ('base', 'older', 'delta')
+
+    def __init__(self, base, older=None, delta=None):
+        self.base = base
+        self.older = {} if older is None else older
+        self.delta = {} if delta is None else delta
+
+    def layer(self):
+        '''
+        A LayeredFreq to make changes to, leaving this one as it is. It
+        shares `base` and `older` and copies `delta`, unless `delta` has
+        more entries than COMPACT_MIN, in which case it is merged into a new
+        `older`, which in turn is merged into a new base once it has more
+        entries than the square root of COMPACT_MIN times the size of
+        `base`. Adding words one by one copies a few hundred entries per
+        word that way, instead of the whole base every few hundred words.
+        '''
+        base, older, delta = self.base, self.older, self.delta
+        if len(delta) <= COMPACT_MIN:
+            return LayeredFreq(base, older, delta.copy())
+        older = older.copy()
+        older.update(delta)
+        if len(older) <= int((len(base) * COMPACT_MIN) ** 0.5):
+            return LayeredFreq(base, older)
+        base = base.copy()
+        base.update(older)
+        return LayeredFreq(base)
+
+    def __repr__(self):
+        return '<LayeredFreq base=%d older=%d delta=%d>' % (
+            len(self.base), len(self.older), len(self.delta))
+
+    def __len__(self):
+        return len(self.base) + sum(1 for _ in self._added())
+
+    def _added(self):
+        base, older = self.base, self.older
+        for word in older:
+            if word not in base:
+                yield word
+        for word in self.delta:
+            if word not in older and word not in base:
+                yield word
+
+    def __iter__(self):
+        for word in self.base:
+            yield word
+        for word in self._added():
+            yield word
+
+    def __contains__(self, word):
+        return word in self.delta or word in self.older or word in self.base
+
+    def __getitem__(self, word):
+        delta, older = self.delta, self.older
+        if word in delta:
+            return delta[word]
+        return older[word] if word in older else self.base[word]
+
+    def __setitem__(self, word, freq):
+        self.delta[word] = freq
+
+    def get(self, word, default=None):
+        delta, older = self.delta, self.older
+        if word in delta:
+            return delta[word]
+        return older[word] if word in older else self.base.get(word, default)
+
+    def items(self):
+        merged = self.base.copy()
+        merged.update(self.older)
+        merged.update(self.delta)
+        return merged.items()
+
+
+def _layer(FREQ):
+    '''A prefix dict to make changes to, leaving `FREQ` as it is.'''
+    if isinstance(FREQ, (TrieFreq, LayeredFreq)):
+        return FREQ.layer()
+    return LayeredFreq(FREQ)
+
+
+def _merge_words(FREQ, words):
+    '''
+    Set the frequencies of (word, freq) pairs in a prefix dict, adding the
+    missing prefixes of each word with a frequency of 0. The prefixes of a
+    word in the dict are in it too, so they are looked up from the longest
+    one down to the first that is there.
+    '''
+    if isinstance(FREQ, TrieFreq):
+        FREQ.merge(words)
+        return
+    if isinstance(FREQ, LayeredFreq):
+        # the prefixes are looked up in the layers without going through
+        # the methods of LayeredFreq
+        delta, older, base = FREQ.delta, FREQ.older, FREQ.base
+        for word, freq in words:
+            delta[word] = freq
+            for ch in xrange(len(word) - 1, 0, -1):
+                wfrag = word[:ch]
+                if wfrag in delta or wfrag in older or wfrag in base:
+                    break
+                delta[wfrag] = 0
+        return
+    for word, freq in words:
+        FREQ[word] = freq
+        for ch in xrange(len(word) - 1, 0, -1):
+            wfrag = word[:ch]
+            if wfrag in FREQ:
+                break
+            FREQ[wfrag] = 0
+
+
 class Tokenizer(object):
 
-    def __init__(self, dictionary=DEFAULT_DICT):
+    def __init__(self, dictionary=DEFAULT_DICT, backend='dict', matcher='prefix'):
+        '''
+        Parameter:
+            - dictionary: Path of the main dictionary, None for the default one.
+            - backend: How the prefix dict is held in memory. "dict" copies
+                       the compact trie in the cache file into a Python dict,
+                       private to each process; without a cache file it uses
+                       the dict parsed from the dictionary at once and writes
+                       the cache on a thread (see `wait_cache_written`).
+                       "trie" memory-maps the cache file, which loads without
+                       parsing and is shared by all processes, but walking it
+                       is slower than hashing: on running Chinese text
+                       `get_DAG`, and so full mode, runs at about two thirds
+                       of the speed of "dict" (see
+                       benchmarks/dag_matchers.py), and without a cache file
+                       the cache has to be built before it can be used.
+            - matcher: How `get_DAG` finds the dictionary words of a block.
+                       "prefix" looks up the fragments starting at every
+                       position; "automaton" finds all of them in one pass
+                       with an Aho-Corasick automaton and needs the "trie"
+                       backend.
+        '''
+        if backend not in DICT_BACKENDS:
+            raise ValueError('jieba: unknown dictionary backend %r' % backend)
+        if matcher not in DAG_MATCHERS:
+            raise ValueError('jieba: unknown DAG matcher %r' % matcher)
+        if matcher == 'automaton' and backend != 'trie':
+            raise ValueError('jieba: the automaton matcher needs the trie backend')
         self.lock = threading.RLock()
+        self.backend = backend
+        self.matcher = matcher
         if dictionary == DEFAULT_DICT:
             self.dictionary = dictionary
         else:
             self.dictionary = _get_abs_path(dictionary)
-        self.FREQ = {}
-        self.total = 0
+        self._snapshot = DictSnapshot({}, 0, 0)
+        # holds the snapshot being built by the writer in this thread
+        self._local = threading.local()
         self.user_word_tag_tab = {}
         self.initialized = False
+        # set once the dictionary is loaded; see `wait_initialized`
+        self.ready = threading.Event()
+        # fraction of the dictionary loaded so far, for progress reports
+        self.init_progress = 0.0
+        self._init_thread = None
+        # writes the cache file after the "dict" backend built the dictionary
+        self._cache_thread = None
         self.tmp_dir = None
         self.cache_file = None
+        self.block_cache = None
+        self.profiler = None
+        # (content key, dict_version, user tags) while the dictionary is
+        # exactly the main dictionary plus the user dictionaries loaded
+        # since, for finding the compiled cache of the next user dictionary
+        self._dict_key = None
 
     def __repr__(self):
-        return '<Tokenizer dictionary=%r>' % self.dictionary
+        return '<Tokenizer dictionary=%r backend=%r matcher=%r>' % (
+            self.dictionary, self.backend, self.matcher)
 
-    def gen_pfdict(self, f):
+    def gen_pfdict(self, f, tags=None, progress=None):
         lfreq = {}
         ltotal = 0
+        # one string per tag name rather than one per word
+        tag_names = {}
         f_name = resolve_filename(f)
         for lineno, line in enumerate(f, 1):
+            if progress is not None and not lineno % 8192:
+                progress(lineno)
             try:
                 line = line.strip().decode('utf-8')
-                word, freq = line.split(' ')[:2]
+                parts = line.split(' ')
+                word, freq = parts[:2]
                 freq = int(freq)
                 lfreq[word] = freq
                 ltotal += freq
+                if tags is not None and len(parts) > 2:
+                    tags[word] = tag_names.setdefault(parts[2], parts[2])
                 for ch in xrange(len(word)):
                     wfrag = word[:ch + 1]
                     if wfrag not in lfreq:
@@ -88,7 +448,29 @@ class Tokenizer(object):
         f.close()
         return lfreq, ltotal
 
-    def initialize(self, dictionary=None):
+    def initialize(self, dictionary=None, background=False):
+        '''
+        Load the dictionary, from the cache file if it is up to date.
+        Parameter:
+            - dictionary: Path of the main dictionary, the current one if None.
+            - background: Load on a daemon thread and return the thread at
+                          once. Wait for it with `wait_initialized` or the
+                          `ready` event, and follow it with `init_progress`.
+                          Returns None, without starting a thread, if the
+                          dictionary is already loaded.
+        '''
+        if background:
+            if self.initialized and (not dictionary or _get_abs_path(dictionary) == self.dictionary):
+                return None
+            with self.lock:
+                thread = self._init_thread
+                if thread is None or not thread.is_alive():
+                    thread = threading.Thread(target=self._initialize_background,
+                                              args=(dictionary,), name='jieba-initialize')
+                    thread.daemon = True
+                    self._init_thread = thread
+                    thread.start()
+            return thread
         if dictionary:
             abs_path = _get_abs_path(dictionary)
             if self.dictionary == abs_path and self.initialized:
@@ -96,6 +478,7 @@ class Tokenizer(object):
             else:
                 self.dictionary = abs_path
                 self.initialized = False
+                self.ready.clear()
         else:
             abs_path = self.dictionary
 
@@ -110,48 +493,74 @@ class Tokenizer(object):
 
             default_logger.debug("Building prefix dict from %s ..." % (abs_path or 'the default dictionary'))
             t1 = time.time()
+            self.init_progress = 0.0
             if self.cache_file:
                 cache_file = self.cache_file
             # default dictionary
             elif abs_path == DEFAULT_DICT:
-                cache_file = "jieba.cache"
+                cache_file = "jieba.bin"
             # custom dictionary
             else:
-                cache_file = "jieba.u%s.cache" % md5(
+                cache_file = "jieba.u%s.bin" % md5(
                     abs_path.encode('utf-8', 'replace')).hexdigest()
             cache_file = os.path.join(
                 self.tmp_dir or tempfile.gettempdir(), cache_file)
-            # prevent absolute path in self.cache_file
-            tmpdir = os.path.dirname(cache_file)
-
-            load_from_cache_fail = True
-            if os.path.isfile(cache_file) and (abs_path == DEFAULT_DICT or
-                os.path.getmtime(cache_file) > os.path.getmtime(abs_path)):
+            # the cache is only valid for the current dictionary content
+            f = self.get_dict_file()
+            content = f.read()
+            f.close()
+            digest = md5(content).digest()
+            nlines = content.count(b'\n') + 1
+            del content
+            self.init_progress = 0.05
+
+            def load_cache():
+                if not os.path.isfile(cache_file):
+                    return False
                 default_logger.debug(
                     "Loading model from cache %s" % cache_file)
                 try:
-                    with open(cache_file, 'rb') as cf:
-                        self.FREQ, self.total = marshal.load(cf)
-                    load_from_cache_fail = False
+                    self.set_prefix_dict(CompactTrie(cache_file, digest))
                 except Exception:
-                    load_from_cache_fail = True
+                    return False
+                return True
 
-            if load_from_cache_fail:
+            if not load_cache():
                 wlock = DICT_WRITING.get(abs_path, threading.RLock())
                 DICT_WRITING[abs_path] = wlock
+                # one process builds the cache, the others wait and load it
                 with wlock:
-                    self.FREQ, self.total = self.gen_pfdict(self.get_dict_file())
-                    default_logger.debug(
-                        "Dumping model to file cache %s" % cache_file)
+                    flock = FileLock(cache_file + '.lock')
+                    flock.acquire()
                     try:
-                        # prevent moving across different filesystems
-                        fd, fpath = tempfile.mkstemp(dir=tmpdir)
-                        with os.fdopen(fd, 'wb') as temp_cache_file:
-                            marshal.dump(
-                                (self.FREQ, self.total), temp_cache_file)
-                        _replace_file(fpath, cache_file)
-                    except Exception:
-                        default_logger.exception("Dump cache file failed.")
+                        if not load_cache():
+                            tags = {}
+                            lfreq, ltotal = self.gen_pfdict(
+                                self.get_dict_file(), tags,
+                                lambda lineno: setattr(self, 'init_progress', 0.05 + 0.55 * lineno / nlines))
+                            self.init_progress = 0.6
+                            if self.backend == 'trie':
+                                cache_data = _trie.dumps(lfreq, ltotal, digest, tags)
+                                del lfreq, tags
+                                self.init_progress = 0.9
+                                self.set_prefix_dict(CompactTrie(cache_data))
+                                if self._dump_cache(cache_file, cache_data):
+                                    # share the mapped file instead of a private copy
+                                    self.set_prefix_dict(CompactTrie(cache_file))
+                            else:
+                                # the dict is ready to use: serializing it takes
+                                # longer than parsing the dictionary did, so it is
+                                # left to a thread, which releases the lock
+                                self._set_snapshot(lfreq, ltotal)
+                                thread = threading.Thread(
+                                    target=self._write_cache, name='jieba-write-cache',
+                                    args=(flock, cache_file, lfreq, ltotal, digest, tags))
+                                self._cache_thread = thread
+                                thread.start()
+                                flock = None
+                    finally:
+                        if flock is not None:
+                            flock.release()
 
                 try:
                     del DICT_WRITING[abs_path]
@@ -159,32 +568,262 @@ class Tokenizer(object):
                     pass
 
             self.initialized = True
+            self._dict_key = (digest, self.dict_version, {})
+            self.init_progress = 1.0
+            self.ready.set()
             default_logger.debug(
                 "Loading model cost %.3f seconds." % (time.time() - t1))
             default_logger.debug("Prefix dict has been built succesfully.")
 
+    def _dump_cache(self, cache_file, cache_data):
+        default_logger.debug("Dumping model to file cache %s" % cache_file)
+        try:
+            _write_file(cache_file, cache_data)
+        except Exception:
+            default_logger.exception("Dump cache file failed.")
+            return False
+        return True
+
+    def _write_cache(self, flock, cache_file, lfreq, ltotal, digest, tags):
+        try:
+            self._dump_cache(cache_file, _trie.dumps(lfreq, ltotal, digest, tags))
+        except Exception:
+            default_logger.exception("Dump cache file failed.")
+        finally:
+            flock.release()
+
+    def wait_cache_written(self, timeout=None):
+        '''
+        Wait for the cache file of the dictionary, which the "dict" backend
+        writes on a thread after building the dictionary, and return whether
+        it is written (or failed to be). Waits at most `timeout` seconds.
+        '''
+        thread = self._cache_thread
+        if thread is not None:
+            thread.join(timeout)
+            return not thread.is_alive()
+        return True
+
+    def _initialize_background(self, dictionary):
+        try:
+            self.initialize(dictionary)
+        except Exception:
+            default_logger.exception("Loading the dictionary in the background failed.")
+
+    def wait_initialized(self, timeout=None):
+        '''
+        Wait for the dictionary to be loaded and return whether it is.
+        Waits at most `timeout` seconds for a load started with
+        `initialize(background=True)`; without one, loads it right away.
+        '''
+        thread = self._init_thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout)
+        else:
+            self.check_initialized()
+        return self.initialized
+
+    def set_prefix_dict(self, trie):
+        '''
+        Use the dictionary stored in a `CompactTrie`. The "trie" backend
+        reads it in place, the "dict" backend copies it into a dict.
+        '''
+        if self.backend == 'trie':
+            self._set_snapshot(TrieFreq(trie), trie.total)
+        else:
+            self._set_snapshot(trie.to_dict(), trie.total)
+
+    @property
+    def snapshot(self):
+        '''
+        The current `DictSnapshot`. Inside `batch`, the writing thread sees
+        the snapshot it is building, every other thread the published one.
+        '''
+        draft = getattr(self._local, 'draft', None)
+        return draft if draft is not None else self._snapshot
+
+    def _set_snapshot(self, FREQ, total):
+        with self.lock:
+            self._snapshot = DictSnapshot(FREQ, total, self._snapshot.version + 1)
+
+    @contextmanager
+    def batch(self):
+        '''
+        Group changes to the dictionary. Inside the block, add_word,
+        del_word, load_userdict and suggest_freq(tune=True) change a
+        private layer over the dictionary (see `LayeredFreq` and
+        `TrieFreq.layer`), which is published as a whole when the block
+        exits; readers keep using the previous version until then.
+        Yields the `DictSnapshot` being built.
+        '''
+        local = self._local
+        if getattr(local, 'draft', None) is not None:
+            yield local.draft
+            return
+        with self.lock:
+            base = self._snapshot
+            local.draft = DictSnapshot(_layer(base.FREQ), base.total, base.version + 1)
+            try:
+                yield local.draft
+            finally:
+                # changes made before an error are kept, as without batching
+                self._snapshot = local.draft
+                local.draft = None
+
+    @property
+    def FREQ(self):
+        return self.snapshot.FREQ
+
+    @FREQ.setter
+    def FREQ(self, FREQ):
+        draft = getattr(self._local, 'draft', None)
+        if draft is not None:
+            draft.FREQ = FREQ
+        else:
+            self._set_snapshot(FREQ, self._snapshot.total)
+
+    @property
+    def total(self):
+        return self.snapshot.total
+
+    @total.setter
+    def total(self, total):
+        draft = getattr(self._local, 'draft', None)
+        if draft is not None:
+            draft.total = total
+        else:
+            self._set_snapshot(self._snapshot.FREQ, total)
+
+    @property
+    def dict_version(self):
+        '''Bumped whenever the dictionary changes, invalidating memoized results.'''
+        return self.snapshot.version
+
     def check_initialized(self):
         if not self.initialized:
             self.initialize()
 
-    def calc(self, sentence, DAG, route):
+    def publish(self, path, tags=None):
+        '''
+        Write the loaded dictionary, including words added since, and the
+        HMM tables of `jieba.finalseg` to the directory `path`, so that other
+        processes can share them with `attach`.
+        Parameter:
+            - path: The directory to write to, created if it does not exist.
+            - tags: The POS tag table stored with the words. Defaults to the
+                    tags of the dictionary plus `user_word_tag_tab`.
+        '''
+        self.check_initialized()
+        snap = self.snapshot
+        if tags is None:
+            tags = TrieTags(snap.FREQ.trie) if self.backend == 'trie' else {}
+            tags.update(self.user_word_tag_tab)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        # no single source dictionary, so never valid as a cache in initialize
+        digest = b'\0' * 16
+        _write_file(os.path.join(path, SHARED_DICT), _trie.dumps(
+            dict(snap.FREQ.items()), snap.total, digest, tags))
+        _write_file(os.path.join(path, SHARED_HMM), _finalseg().dumps_model())
+        return path
+
+    def attach(self, path, copy_hmm=False):
+        '''
+        Use the dictionary and HMM tables written by `publish` to the
+        directory `path`. With the "trie" backend the dictionary is read in
+        place through a read-only memory map shared by all attached
+        processes. The HMM tables are module level and thus shared by every
+        Tokenizer of the process. They are memory-mapped too, unless
+        `copy_hmm`: then they are copied into dicts, which takes more memory
+        but runs the HMM about twice as fast.
+        '''
+        with self.lock:
+            self.set_prefix_dict(CompactTrie(os.path.join(path, SHARED_DICT)))
+            self.initialized = True
+            self._dict_key = None
+            self.ready.set()
+        _finalseg().attach_model(os.path.join(path, SHARED_HMM), copy_hmm)
+
+    def calc(self, sentence, DAG, route, snapshot=None):
+        prof = self.profiler
+        if prof is None:
+            return self._calc(sentence, DAG, route, snapshot)
+        t = timer()
+        try:
+            return self._calc(sentence, DAG, route, snapshot)
+        finally:
+            prof.add('calc', timer() - t, len(sentence))
+
+    def _calc(self, sentence, DAG, route, snapshot):
+        snap = snapshot or self.snapshot
+        FREQ = snap.FREQ
+        if self.backend == 'trie':
+            return FREQ.calc(sentence, DAG, route, snap.total)
         N = len(sentence)
         route[N] = (0, 0)
-        logtotal = log(self.total)
+        logtotal = log(snap.total)
+        if isinstance(FREQ, LayeredFreq):
+            delta_get = FREQ.delta.get
+            older_get = FREQ.older.get
+            base_get = FREQ.base.get
+            for idx in xrange(N - 1, -1, -1):
+                route[idx] = max((log(delta_get(sentence[idx:x + 1], older_get(
+                    sentence[idx:x + 1], base_get(sentence[idx:x + 1]))) or 1) -
+                                  logtotal + route[x + 1][0], x) for x in DAG[idx])
+            return
         for idx in xrange(N - 1, -1, -1):
-            route[idx] = max((log(self.FREQ.get(sentence[idx:x + 1]) or 1) -
+            route[idx] = max((log(FREQ.get(sentence[idx:x + 1]) or 1) -
                               logtotal + route[x + 1][0], x) for x in DAG[idx])
 
-    def get_DAG(self, sentence):
+    def get_DAG(self, sentence, snapshot=None):
         self.check_initialized()
+        prof = self.profiler
+        if prof is None:
+            return self._get_DAG(sentence, snapshot)
+        t = timer()
+        try:
+            return self._get_DAG(sentence, snapshot)
+        finally:
+            prof.add('get_DAG', timer() - t, len(sentence))
+
+    def _get_DAG(self, sentence, snapshot):
+        FREQ = (snapshot or self.snapshot).FREQ
+        if self.matcher == 'automaton':
+            return FREQ.get_DAG_automaton(sentence)
+        if self.backend == 'trie':
+            return FREQ.get_DAG(sentence)
         DAG = {}
         N = len(sentence)
+        if isinstance(FREQ, LayeredFreq):
+            delta = FREQ.delta
+            older = FREQ.older
+            base = FREQ.base
+            for k in xrange(N):
+                tmplist = []
+                i = k
+                frag = sentence[k]
+                while i < N:
+                    f = delta.get(frag)
+                    if f is None:
+                        f = older.get(frag)
+                        if f is None:
+                            f = base.get(frag)
+                            if f is None:
+                                break
+                    if f:
+                        tmplist.append(i)
+                    i += 1
+                    frag = sentence[k:i + 1]
+                if not tmplist:
+                    tmplist.append(k)
+                DAG[k] = tmplist
+            return DAG
         for k in xrange(N):
             tmplist = []
             i = k
             frag = sentence[k]
-            while i < N and frag in self.FREQ:
-                if self.FREQ[frag]:
+            while i < N and frag in FREQ:
+                if FREQ[frag]:
                     tmplist.append(i)
                 i += 1
                 frag = sentence[k:i + 1]
@@ -193,8 +832,80 @@ class Tokenizer(object):
             DAG[k] = tmplist
         return DAG
 
-    def __cut_all(self, sentence):
-        dag = self.get_DAG(sentence)
+    def get_route(self, sentence, snapshot=None):
+        '''
+        Return the best route through the DAG of `sentence`, as filled in
+        by `calc`. The "trie" backend scores the edges by word id with the
+        precomputed log frequencies of the dictionary. `snapshot` is the
+        `DictSnapshot` to use, the current one if None.
+        '''
+        self.check_initialized()
+        snap = snapshot or self.snapshot
+        prof = self.profiler
+        if self.backend != 'trie':
+            if prof is None:
+                return self._route_dict(sentence, snap)
+            DAG = self.get_DAG(sentence, snap)
+            route = {}
+            self.calc(sentence, DAG, route, snap)
+            return route
+        if prof is not None:
+            t = timer()
+        ids = {}
+        if self.matcher == 'automaton':
+            DAG = snap.FREQ.get_DAG_automaton(sentence, ids)
+        else:
+            DAG = snap.FREQ.get_DAG(sentence, ids)
+        if prof is not None:
+            t1 = timer()
+            prof.add('get_DAG', t1 - t, len(sentence))
+        route = {}
+        snap.FREQ.calc_ids(DAG, ids, route, snap.total)
+        if prof is not None:
+            prof.add('calc', timer() - t1, len(sentence))
+        return route
+
+    @staticmethod
+    def _route_dict(sentence, snap):
+        # get_DAG and calc of the "dict" backend in one pass from the end,
+        # scoring each fragment as it is looked up; the scores and the ties
+        # are those of calc
+        FREQ = snap.FREQ
+        if isinstance(FREQ, LayeredFreq):
+            delta_get = FREQ.delta.get
+            older_get = FREQ.older.get
+            base_get = FREQ.base.get
+        else:
+            delta_get = None
+            base_get = FREQ.get
+        N = len(sentence)
+        route = {N: (0, 0)}
+        logtotal = log(snap.total)
+        for k in xrange(N - 1, -1, -1):
+            best = None
+            i = k
+            frag = sentence[k]
+            while i < N:
+                f = base_get(frag) if delta_get is None else delta_get(
+                    frag, older_get(frag, base_get(frag)))
+                if f is None:
+                    break
+                if f:
+                    score = (log(f) - logtotal + route[i + 1][0], i)
+                    if best is None or score > best:
+                        best = score
+                i += 1
+                frag = sentence[k:i + 1]
+            if best is None:
+                ch = sentence[k]
+                f = base_get(ch) if delta_get is None else delta_get(
+                    ch, older_get(ch, base_get(ch)))
+                best = (log(f or 1) - logtotal + route[k + 1][0], k)
+            route[k] = best
+        return route
+
+    def __cut_all(self, sentence, snap):
+        dag = self.get_DAG(sentence, snap)
         old_j = -1
         for k, L in iteritems(dag):
             if len(L) == 1 and k > old_j:
@@ -206,10 +917,8 @@ class Tokenizer(object):
                         yield sentence[k:j + 1]
                         old_j = j
 
-    def __cut_DAG_NO_HMM(self, sentence):
-        DAG = self.get_DAG(sentence)
-        route = {}
-        self.calc(sentence, DAG, route)
+    def __cut_DAG_NO_HMM(self, sentence, snap):
+        route = self.get_route(sentence, snap)
         x = 0
         N = len(sentence)
         buf = ''
@@ -229,10 +938,10 @@ class Tokenizer(object):
             yield buf
             buf = ''
 
-    def __cut_DAG(self, sentence):
-        DAG = self.get_DAG(sentence)
-        route = {}
-        self.calc(sentence, DAG, route)
+    def __cut_DAG(self, sentence, snap):
+        # a run of single characters that is not a word is yielded as an
+        # (unknown,) tuple, for _resolve_unknown to cut with the HMM
+        route = self.get_route(sentence, snap)
         x = 0
         buf = ''
         N = len(sentence)
@@ -247,10 +956,8 @@ class Tokenizer(object):
                         yield buf
                         buf = ''
                     else:
-                        if not self.FREQ.get(buf):
-                            recognized = finalseg.cut(buf)
-                            for t in recognized:
-                                yield t
+                        if not snap.FREQ.get(buf):
+                            yield (buf,)
                         else:
                             for elem in buf:
                                 yield elem
@@ -261,14 +968,63 @@ class Tokenizer(object):
         if buf:
             if len(buf) == 1:
                 yield buf
-            elif not self.FREQ.get(buf):
-                recognized = finalseg.cut(buf)
-                for t in recognized:
-                    yield t
+            elif not snap.FREQ.get(buf):
+                yield (buf,)
             else:
                 for elem in buf:
                     yield elem
 
+    def _hmm_words(self, unknown):
+        '''Fill the dict `unknown`, keyed by unknown runs, with their words.'''
+        bufs = list(unknown)
+        prof = self.profiler
+        if prof is None:
+            words = _finalseg().cut_batch(bufs)
+        else:
+            t = timer()
+            words = _finalseg().cut_batch(bufs)
+            prof.add('hmm', timer() - t, sum(map(len, bufs)))
+        for buf, buf_words in zip(bufs, words):
+            unknown[buf] = buf_words
+
+    @staticmethod
+    def _replace_unknown(parts, unknown):
+        words = []
+        for part in parts:
+            if type(part) is tuple:
+                words.extend(unknown[part[0]])
+            else:
+                words.append(part)
+        return words
+
+    def _resolve_unknown(self, chunks):
+        '''
+        Yield the words of `chunks`, iterables of the output of __cut_DAG
+        and of other words, cutting the unknown runs with the HMM. Up to
+        HMM_BATCH distinct runs are cut together, the words after the first
+        of them being held back until then.
+        '''
+        pending = []
+        unknown = {}
+        for chunk in chunks:
+            for part in chunk:
+                if type(part) is tuple:
+                    unknown[part[0]] = None
+                elif not pending:
+                    yield part
+                    continue
+                pending.append(part)
+            if pending and (len(unknown) >= HMM_BATCH or len(pending) >= HMM_PENDING):
+                self._hmm_words(unknown)
+                for word in self._replace_unknown(pending, unknown):
+                    yield word
+                pending = []
+                unknown = {}
+        if pending:
+            self._hmm_words(unknown)
+            for word in self._replace_unknown(pending, unknown):
+                yield word
+
     def cut(self, sentence, cut_all=False, HMM=True):
         '''
         The main function that segments an entire sentence that contains
@@ -278,56 +1034,364 @@ class Tokenizer(object):
             - cut_all: Model type. True for full pattern, False for accurate pattern.
             - HMM: Whether to use the Hidden Markov Model.
         '''
+        chunks = self._cut(sentence, cut_all, HMM)
+        if HMM and not cut_all:
+            # the unknown runs of all the blocks are cut together
+            return self._resolve_unknown(chunks)
+        return self._flatten(chunks)
+
+    @staticmethod
+    def _flatten(chunks):
+        for chunk in chunks:
+            for word in chunk:
+                yield word
+
+    def _cut(self, sentence, cut_all, HMM, snap=None, segmented=None):
+        # yields the words of each span together, as an iterable; the blocks
+        # are cut with `snap`, the current snapshot if None, and memoized in
+        # the dict `segmented` if given
         sentence = strdecode(sentence)
 
-        if cut_all:
-            re_han = re_han_cut_all
-            re_skip = re_skip_cut_all
-        else:
-            re_han = re_han_default
-            re_skip = re_skip_default
         if cut_all:
             cut_block = self.__cut_all
         elif HMM:
             cut_block = self.__cut_DAG
         else:
             cut_block = self.__cut_DAG_NO_HMM
-        blocks = re_han.split(sentence)
-        for blk in blocks:
-            if not blk:
+        # the whole sentence is cut with one version of the dictionary
+        prof = self.profiler
+        if cut_all:
+            spans = re_scan_cut_all.finditer(sentence)
+        else:
+            spans = re_scan_default.finditer(sentence)
+        if prof is not None:
+            t = timer()
+            spans = list(spans)
+            prof.add('split', timer() - t, len(sentence))
+        # in full mode, a block without Chinese characters is cut into the
+        # pieces between the separators, empty ones included, as
+        # re_skip_cut_all.split does
+        in_block = False
+        piece = ''
+        for m in spans:
+            kind = m.lastindex
+            if kind == SPAN_HAN:
+                if in_block:
+                    yield (piece,)
+                    in_block = False
+                    piece = ''
+                if snap is None:
+                    self.check_initialized()
+                    snap = self.snapshot
+                if segmented is None:
+                    yield self._cut_block(m.group(), cut_block, cut_all, HMM, snap)
+                    continue
+                blk = m.group()
+                blk_words = segmented.get(blk)
+                if blk_words is None:
+                    blk_words = segmented[blk] = list(
+                        self._cut_block(blk, cut_block, cut_all, HMM, snap))
+                yield blk_words
+            elif cut_all:
+                in_block = True
+                if kind == SPAN_KEEP:
+                    piece = m.group()
+                else:
+                    yield (piece,)
+                    piece = ''
+            elif kind == SPAN_SKIP:
+                yield (m.group(),)
+            else:
+                # one word per character
+                yield m.group()
+        if in_block:
+            yield (piece,)
+
+    def cut_offsets(self, sentence, HMM=True):
+        '''
+        Segment a sentence in accurate mode, returning the start and end
+        offsets of the words as two `array('i')` (C int, i.e. int32) instead
+        of one string or tuple per word. `numpy.frombuffer(starts,
+        dtype=numpy.int32)` views them without copying. The offsets come
+        from the routes, so only the runs cut with the HMM become strings;
+        the block cache of `enable_cache` is not used.
+        Parameter:
+            - sentence: The str(unicode) to be segmented.
+            - HMM: Whether to use the Hidden Markov Model.
+        '''
+        sentence = strdecode(sentence)
+        ends = array(str('i'))
+        snap = None
+        # the words cover the sentence, so each starts where the one before
+        # it ends and only the ends are kept. They are taken from the routes
+        # and the spans, as __cut_DAG and __cut_DAG_NO_HMM walk them,
+        # without slicing out the words; an unknown run is held as minus one
+        # minus its index in `runs` until its words are cut with the HMM,
+        # HMM_BATCH runs at a time
+        runs = {}
+        batch = {}
+        run_lengths = []
+        for m in re_scan_default.finditer(sentence):
+            kind = m.lastindex
+            lo, hi = m.span()
+            if kind == SPAN_SKIP:
+                ends.append(hi)
+                continue
+            if kind == SPAN_OTHER:
+                ends.extend(xrange(lo + 1, hi + 1))
+                continue
+            if snap is None:
+                self.check_initialized()
+                snap = self.snapshot
+                get = snap.FREQ.get
+            route = self.get_route(m.group(), snap)
+            x = 0
+            N = hi - lo
+            buf = 0
+            if not HMM:
+                while x < N:
+                    y = route[x][1] + 1
+                    # consecutive single letters and digits are one word
+                    if y - x != 1 or not re_eng.match(sentence, lo + x):
+                        if buf:
+                            ends.append(lo + x)
+                            buf = 0
+                        ends.append(lo + y)
+                    else:
+                        buf = 1
+                    x = y
+                if buf:
+                    ends.append(hi)
+                continue
+            # single characters from lo + buf to lo + x
+            while x <= N:
+                y = route[x][1] + 1 if x < N else x
+                if y - x != 1:
+                    if x - buf > 1 and not get(sentence[lo + buf:lo + x]):
+                        run = sentence[lo + buf:lo + x]
+                        idx = runs.get(run)
+                        if idx is None:
+                            idx = runs[run] = len(run_lengths)
+                            run_lengths.append(None)
+                            batch[run] = None
+                        ends.append(-1 - idx)
+                        if len(batch) >= HMM_BATCH:
+                            self._run_lengths(batch, runs, run_lengths)
+                    else:
+                        ends.extend(xrange(lo + buf + 1, lo + x + 1))
+                    if x == N:
+                        break
+                    ends.append(lo + y)
+                    buf = y
+                x = y
+        if runs:
+            if batch:
+                self._run_lengths(batch, runs, run_lengths)
+            resolved = array(str('i'))
+            start = 0
+            for end in ends:
+                if end < 0:
+                    for length in run_lengths[-1 - end]:
+                        start += length
+                        resolved.append(start)
+                else:
+                    resolved.append(end)
+                    start = end
+            ends = resolved
+        starts = array(str('i'), [0]) if ends else array(str('i'))
+        starts.extend(ends[:-1])
+        return starts, ends
+
+    def _run_lengths(self, batch, runs, run_lengths):
+        # the word lengths of the unknown runs in the dict `batch`, which is
+        # emptied, into run_lengths at their index in `runs`
+        self._hmm_words(batch)
+        for run, words in iteritems(batch):
+            run_lengths[runs[run]] = array(str('i'), [len(w) for w in words])
+        batch.clear()
+
+    def cut_batch(self, texts, cut_all=False, HMM=True, offsets=False):
+        '''
+        Segment many texts at once, giving the same words as `cut` for each
+        of them. Blocks of Chinese characters that occur repeatedly in the
+        batch are segmented only once, and the runs of unknown characters
+        of all the texts are cut by the HMM together.
+        Parameter:
+            - texts: An iterable of str(unicode) to be segmented.
+            - cut_all: Model type. True for full pattern, False for accurate pattern.
+            - HMM: Whether to use the Hidden Markov Model.
+            - offsets: Return the start and end offsets of the words of each
+                       text as two `array('i')`, as `cut_offsets` does,
+                       instead of words. Not available with cut_all.
+        Returns a list holding the result of each text, in order.
+        '''
+        if cut_all and offsets:
+            raise ValueError("jieba: offsets are not available with cut_all")
+        self.check_initialized()
+        snap = self.snapshot
+        segmented = {}
+        results = []
+        for sentence in texts:
+            words = []
+            for chunk in self._cut(sentence, cut_all, HMM, snap, segmented):
+                words.extend(chunk)
+            results.append(words)
+        unknown = {}
+        if HMM and not cut_all:
+            # the distinct unknown runs of all the texts are cut together
+            for words in results:
+                unknown.update((part[0], None) for part in words if type(part) is tuple)
+            if unknown:
+                self._hmm_words(unknown)
+        for i, words in enumerate(results):
+            if unknown:
+                words = self._replace_unknown(words, unknown)
+            if offsets:
+                starts = array(str('i'))
+                ends = array(str('i'))
+                pos = 0
+                for w in words:
+                    starts.append(pos)
+                    pos += len(w)
+                    ends.append(pos)
+                words = (starts, ends)
+            results[i] = words
+        return results
+
+    def recut(self, old_sentence, old_words, sentence, cut_all=False, HMM=True):
+        '''
+        Segment `sentence`, an edited version of `old_sentence`, reusing
+        `old_words`, the words `cut` gave for `old_sentence` with the same
+        settings and dictionary. Only the region around the edit is cut
+        again. Returns a list of words, the same as `lcut(sentence)`.
+        Parameter:
+            - old_sentence: The text before the edit.
+            - old_words: The words of old_sentence.
+            - sentence: The text after the edit.
+            - cut_all: Model type. Full pattern is always cut from scratch.
+            - HMM: Whether to use the Hidden Markov Model.
+        '''
+        old_sentence = strdecode(old_sentence)
+        sentence = strdecode(sentence)
+        if cut_all or len(old_sentence) != sum(map(len, old_words)):
+            return self.lcut(sentence, cut_all, HMM)
+        # the edit lies within sentence[prefix:len(sentence) - suffix]
+        prefix = _common_prefix_len(old_sentence, sentence)
+        suffix = _common_suffix_len(old_sentence, sentence,
+                                    min(len(old_sentence), len(sentence)) - prefix)
+        shift = len(sentence) - len(old_sentence)
+        # widen it to boundaries that are safe in both texts, so that
+        # cutting the pieces on either side separately changes nothing
+        left = prefix
+        while not (_safe_boundary(old_sentence, left) and _safe_boundary(sentence, left)):
+            left -= 1
+        right = len(sentence) - suffix
+        while not (_safe_boundary(old_sentence, right - shift) and
+                   _safe_boundary(sentence, right)):
+            right += 1
+
+        head = []
+        tail = []
+        pos = 0
+        for word in old_words:
+            if pos + len(word) <= left:
+                head.append(word)
+            elif pos >= right - shift:
+                tail.append(word)
+            elif pos < left:
+                # old_words do not break at a safe boundary: not a result of cut
+                return self.lcut(sentence, cut_all, HMM)
+            pos += len(word)
+        if sum(map(len, tail)) != len(old_sentence) - right + shift:
+            return self.lcut(sentence, cut_all, HMM)
+        head.extend(self.cut(sentence[left:right], cut_all, HMM))
+        head.extend(tail)
+        return head
+
+    def cut_stream(self, source, chunk_chars=65536, cut_all=False, HMM=True,
+                   offsets=False, encoding='utf-8', use_mmap=False):
+        '''
+        Segment a text read piece by piece, yielding the same words as `cut`
+        on the whole text. The text is only cut at boundaries that `cut`
+        cannot segment across, so memory use is bounded by `chunk_chars`
+        plus the longest run of text without such a boundary.
+        Parameter:
+            - source: A path, a file object in text or binary mode, or a
+                      bytes-like object such as an mmap.
+            - chunk_chars: How much to read at a time, in characters for
+                           text files and in bytes otherwise.
+            - cut_all: Model type. True for full pattern, False for accurate pattern.
+            - HMM: Whether to use the Hidden Markov Model.
+            - offsets: Yield (word, start, end) tuples with offsets from the
+                       start of the text, as `tokenize` does. Not available
+                       with cut_all.
+            - encoding: Encoding of binary input.
+            - use_mmap: Memory-map `source` if it is a path.
+        '''
+        if cut_all and offsets:
+            raise ValueError("jieba: offsets are not available with cut_all")
+        safe_boundary = _safe_boundary_all if cut_all else _safe_boundary
+        pending = ''
+        # boundaries 1 .. checked of pending are known not to be safe
+        checked = 0
+        start = 0
+        for piece in _read_text(source, chunk_chars, encoding, use_mmap):
+            pending += piece
+            i = len(pending) - 1
+            while i > checked and not safe_boundary(pending, i):
+                i -= 1
+            if i <= checked:
+                checked = max(len(pending) - 1, 0)
                 continue
-            if re_han.match(blk):
-                for word in cut_block(blk):
+            text, pending = pending[:i], pending[i:]
+            checked = 0
+            for word in self.cut(text, cut_all, HMM):
+                if offsets:
+                    yield (word, start, start + len(word))
+                    start += len(word)
+                else:
                     yield word
+        for word in self.cut(pending, cut_all, HMM):
+            if offsets:
+                yield (word, start, start + len(word))
+                start += len(word)
             else:
-                tmp = re_skip.split(blk)
-                for x in tmp:
-                    if re_skip.match(x):
-                        yield x
-                    elif not cut_all:
-                        for xx in x:
-                            yield xx
-                    else:
-                        yield x
+                yield word
 
     def cut_for_search(self, sentence, HMM=True):
         """
         Finer segmentation for search engines.
         """
+        self.check_initialized()
+        FREQ = self.FREQ
         words = self.cut(sentence, HMM=HMM)
         for w in words:
             if len(w) > 2:
-                for i in xrange(len(w) - 1):
-                    gram2 = w[i:i + 2]
-                    if self.FREQ.get(gram2):
-                        yield gram2
-            if len(w) > 3:
-                for i in xrange(len(w) - 2):
-                    gram3 = w[i:i + 3]
-                    if self.FREQ.get(gram3):
-                        yield gram3
+                for i, j in self._search_grams(w, FREQ):
+                    yield w[i:j]
             yield w
 
+    def _search_grams(self, w, FREQ=None):
+        '''
+        Offsets of the in-dictionary 2-grams and 3-grams of w that search
+        mode yields before w itself. The "trie" backend looks them up in
+        the sub-word index of the dictionary cache.
+        '''
+        if FREQ is None:
+            FREQ = self.FREQ
+        if self.backend == 'trie':
+            return FREQ.search_grams(w)
+        grams = []
+        if len(w) > 2:
+            for i in xrange(len(w) - 1):
+                if FREQ.get(w[i:i + 2]):
+                    grams.append((i, i + 2))
+        if len(w) > 3:
+            for i in xrange(len(w) - 2):
+                if FREQ.get(w[i:i + 3]):
+                    grams.append((i, i + 3))
+        return grams
+
     def lcut(self, *args, **kwargs):
         return list(self.cut(*args, **kwargs))
 
@@ -352,24 +1416,133 @@ class Tokenizer(object):
         else:
             return open(self.dictionary, 'rb')
 
-    def load_userdict(self, f):
+    def load_userdict(self, f, bulk=False):
         '''
         Load personalized dict to improve detect rate.
         Parameter:
             - f : A plain text file contains words and their ocurrences.
                   Can be a file-like object, or the path of the dictionary file,
                   whose encoding must be utf-8.
+            - bulk : Add the words with `add_words`, which is much faster for
+                     large files but suggests the frequencies left out
+                     against the dictionary as it was before loading.
         Structure of dict file:
         word1 freq1 word_type1
         word2 freq2 word_type2
         ...
         Word type may be ignored
+
+        A user dictionary of USERDICT_COMPILE_MIN lines or more is merged
+        once and compiled with the main dictionary to a cache file keyed by
+        the content of the main dictionary and of the user dictionaries
+        loaded so far, in order, so loading the same user dictionaries again
+        costs no more than loading the main dictionary. Only the
+        USERDICT_CACHE_FILES most recently used of these files are kept.
         '''
         self.check_initialized()
         if isinstance(f, string_types):
             f_name = f
-            f = open(f, 'rb')
+            with open(f, 'rb') as fobj:
+                data = fobj.read()
+        else:
+            f_name = resolve_filename(f)
+            data = f.read()
+        if isinstance(data, text_type):
+            data = data.encode('utf-8')
+        with self.lock:
+            chain = self._dict_key
+            if chain is not None and chain[1] == self.dict_version:
+                key = md5(b''.join((chain[0], md5(data).digest(), self.backend.encode('ascii'),
+                                    b'bulk' if bulk else b''))).digest()
+                cache_file = os.path.join(self.tmp_dir or tempfile.gettempdir(),
+                                          "jieba.m%s.bin" % codecs.encode(key, 'hex').decode('ascii'))
+                if self._load_compiled_userdict(cache_file, key):
+                    return
+                if data.count(b'\n') + 1 < USERDICT_COMPILE_MIN:
+                    # cheaper to merge than to compile, but still chained
+                    # for the user dictionaries loaded next
+                    user_tags = self._merge_userdict(data, f_name, bulk, chain[2])
+                    self._dict_key = (key, self.dict_version, user_tags)
+                    return
+                # one process compiles the cache, the others wait and load it
+                with FileLock(cache_file + '.lock'):
+                    if not self._load_compiled_userdict(cache_file, key):
+                        user_tags = self._merge_userdict(data, f_name, bulk, chain[2])
+                        self._dump_compiled_userdict(cache_file, key, user_tags)
+                _prune_compiled_userdicts(os.path.dirname(cache_file))
+            else:
+                self._merge_userdict(data, f_name, bulk, {})
+
+    def _merge_userdict(self, data, f_name, bulk, user_tags):
+        '''
+        Add the entries of the user dictionary `data` and return the tags of
+        the user dictionaries loaded so far, given those before, `user_tags`.
+        '''
+        user_tags = dict(user_tags)
+
+        def entries():
+            for word, freq, tag in self._read_userdict(io.BytesIO(data), f_name):
+                if tag:
+                    user_tags[word] = tag
+                yield word, freq, tag
+
+        self._dict_key = None
+        if bulk:
+            self.add_words(entries())
         else:
+            # as many add_word calls, published as one new version of the
+            # dictionary
+            with self.batch() as draft:
+                words = []
+                for word, freq, tag in entries():
+                    self._add_word(draft, word, freq, tag)
+                    words.append(word)
+            self._discard_hmm(words)
+        return user_tags
+
+    def _load_compiled_userdict(self, cache_file, key):
+        '''Switch to the compiled dictionary in `cache_file` if it is valid for `key`.'''
+        if not os.path.isfile(cache_file):
+            return False
+        default_logger.debug("Loading user dictionaries from cache %s" % cache_file)
+        try:
+            trie = CompactTrie(cache_file, key)
+        except Exception:
+            return False
+        try:
+            # most recently used, for _prune_compiled_userdicts
+            os.utime(cache_file, None)
+        except (IOError, OSError):
+            pass
+        self.set_prefix_dict(trie)
+        user_tags = trie.user_tags()
+        self.user_word_tag_tab.update(user_tags)
+        self._dict_key = (key, self.dict_version, user_tags)
+        return True
+
+    def _dump_compiled_userdict(self, cache_file, key, user_tags):
+        '''Write the dictionary with the user dictionaries merged in to `cache_file`.'''
+        snap = self._snapshot
+        tags = TrieTags(snap.FREQ.trie) if self.backend == 'trie' else None
+        default_logger.debug("Dumping user dictionaries to file cache %s" % cache_file)
+        try:
+            _write_file(cache_file, _trie.dumps(
+                dict(snap.FREQ.items()), snap.total, key, tags, user_tags))
+            if self.backend == 'trie':
+                # share the mapped file instead of the private overlay
+                self.set_prefix_dict(CompactTrie(cache_file, key))
+        except Exception:
+            default_logger.exception("Dump cache file failed.")
+            return
+        self._dict_key = (key, self.dict_version, user_tags)
+
+    @staticmethod
+    def _read_userdict(f, f_name=None):
+        '''Yield the (word, freq, tag) entries of a user dictionary.'''
+        if isinstance(f, string_types):
+            f_name = f
+            f = open(f, 'rb')
+        elif f_name is None:
             f_name = resolve_filename(f)
         for lineno, ln in enumerate(f, 1):
             line = ln.strip()
@@ -386,7 +1559,7 @@ class Tokenizer(object):
                 freq = freq.strip()
             if tag is not None:
                 tag = tag.strip()
-            self.add_word(word, freq, tag)
+            yield word, freq, tag
 
     def add_word(self, word, freq=None, tag=None):
         """
@@ -396,15 +1569,85 @@ class Tokenizer(object):
         """
         self.check_initialized()
         word = strdecode(word)
-        freq = int(freq) if freq is not None else self.suggest_freq(word, False)
-        self.FREQ[word] = freq
-        self.total += freq
+        with self.batch() as draft:
+            self._add_word(draft, word, freq, tag)
+        self._discard_hmm((word,))
+
+    def _add_word(self, draft, word, freq, tag):
+        if freq is None:
+            freq = self._suggested_freq(draft, word, self._words_no_hmm(word, draft))
+        else:
+            freq = int(freq)
+        _merge_words(draft.FREQ, ((word, freq),))
+        draft.total += freq
         if tag:
             self.user_word_tag_tab[word] = tag
-        for ch in xrange(len(word)):
-            wfrag = word[:ch + 1]
-            if wfrag not in self.FREQ:
-                self.FREQ[wfrag] = 0
+
+    def add_words(self, words):
+        """
+        Add many words at once, with one merge into the dictionary and one
+        update of the total, published as one new version. Frequencies
+        left out are suggested in a batch against the dictionary as it was
+        before the call, without the other words being added.
+        Parameter:
+            - words: An iterable of words or of (word, freq, tag) tuples,
+                     where freq and tag may be None.
+        """
+        self.check_initialized()
+        snap = self.snapshot
+        entries = []
+        for item in words:
+            if isinstance(item, string_types):
+                word, freq, tag = item, None, None
+            elif len(item) == 3:
+                word, freq, tag = item
+            else:
+                word, freq, tag = (tuple(item) + (None, None))[:3]
+            entries.append((strdecode(word), int(freq) if freq is not None else None, tag))
+        # suggested against `snap`, not against the draft being changed
+        suggested = dict((word, self._suggested_freq(snap, word, self._words_no_hmm(word, snap)))
+                         for word in set(word for word, freq, tag in entries if freq is None))
+        with self.batch() as draft:
+            FREQ = draft.FREQ
+            pairs = []
+            for word, freq, tag in entries:
+                pairs.append((word, suggested[word] if freq is None else freq))
+                if tag:
+                    self.user_word_tag_tab[word] = tag
+            _merge_words(FREQ, pairs)
+            draft.total += sum(freq for word, freq in pairs)
+        self._discard_hmm(word for word, freq in pairs)
+
+    @staticmethod
+    def _discard_hmm(words):
+        # runs that are words now are no longer cut with the HMMs, so their
+        # cached results would only take up room; modules not imported yet
+        # have nothing cached
+        modules = [module for module in (sys.modules.get(__name__ + '.finalseg'),
+                                         sys.modules.get(__name__ + '.posseg'))
+                   if module is not None and module.cache_info() is not None]
+        if not modules:
+            return
+        for word in words:
+            for module in modules:
+                module.discard(word)
+
+    def _words_no_hmm(self, sentence, snap):
+        '''The words of `lcut(sentence, HMM=False)`, cut with `snap`.'''
+        m = re_scan_default.match(sentence)
+        if m is not None and m.lastindex == SPAN_HAN and m.end() == len(sentence):
+            # one block, cut straight from its route
+            return self.__cut_DAG_NO_HMM(sentence, snap)
+        return self._flatten(self._cut(sentence, False, False, snap))
+
+    @staticmethod
+    def _suggested_freq(snap, word, segs):
+        '''The frequency `suggest_freq` gives `word`, which `cut` splits into `segs`.'''
+        ftotal = float(snap.total)
+        freq = 1
+        for seg in segs:
+            freq *= snap.FREQ.get(seg, 1) / ftotal
+        return max(int(freq * snap.total) + 1, snap.FREQ.get(word, 1))
 
     def del_word(self, word):
         """
@@ -424,19 +1667,18 @@ class Tokenizer(object):
         set HMM=False.
         """
         self.check_initialized()
-        ftotal = float(self.total)
+        snap = self.snapshot
+        ftotal = float(snap.total)
         freq = 1
         if isinstance(segment, string_types):
             word = segment
-            for seg in self.cut(word, HMM=False):
-                freq *= self.FREQ.get(seg, 1) / ftotal
-            freq = max(int(freq * self.total) + 1, self.FREQ.get(word, 1))
+            freq = self._suggested_freq(snap, word, self._words_no_hmm(word, snap))
         else:
             segment = tuple(map(strdecode, segment))
             word = ''.join(segment)
             for seg in segment:
-                freq *= self.FREQ.get(seg, 1) / ftotal
-            freq = min(int(freq * self.total), self.FREQ.get(word, 0))
+                freq *= snap.FREQ.get(seg, 1) / ftotal
+            freq = min(int(freq * snap.total), snap.FREQ.get(word, 0))
         if tune:
             add_word(word, freq)
         return freq
@@ -458,18 +1700,13 @@ class Tokenizer(object):
                 yield (w, start, start + width)
                 start += width
         else:
+            self.check_initialized()
+            FREQ = self.FREQ
             for w in self.cut(unicode_sentence, HMM=HMM):
                 width = len(w)
-                if len(w) > 2:
-                    for i in xrange(len(w) - 1):
-                        gram2 = w[i:i + 2]
-                        if self.FREQ.get(gram2):
-                            yield (gram2, start + i, start + i + 2)
-                if len(w) > 3:
-                    for i in xrange(len(w) - 2):
-                        gram3 = w[i:i + 3]
-                        if self.FREQ.get(gram3):
-                            yield (gram3, start + i, start + i + 3)
+                if width > 2:
+                    for i, j in self._search_grams(w, FREQ):
+                        yield (w[i:j], start + i, start + j)
                 yield (w, start, start + width)
                 start += width
 
@@ -480,6 +1717,75 @@ class Tokenizer(object):
                 raise Exception("jieba: file does not exist: " + abs_path)
             self.dictionary = abs_path
             self.initialized = False
+            self.ready.clear()
+            self._set_snapshot(self._snapshot.FREQ, self._snapshot.total)
+
+    def enable_cache(self, maxsize=10000, maxbytes=None):
+        '''
+        Memoize the words of blocks of Chinese characters, keyed by
+        (block, cut_all, HMM). Changing the dictionary invalidates the
+        cache.
+        Parameter:
+            - maxsize: Maximum number of blocks kept, None for no limit.
+            - maxbytes: Maximum estimated size of the cached blocks and
+                        words in bytes, None for no limit.
+        '''
+        self.block_cache = LRUCache(maxsize, maxbytes)
+        self._cache_version = self.dict_version
+
+    def disable_cache(self):
+        self.block_cache = None
+
+    def cache_info(self):
+        '''
+        Hits, misses, size and limits of the block cache, or None if it is
+        disabled.
+        '''
+        cache = self.block_cache
+        return cache.stats() if cache is not None else None
+
+    def enable_profiling(self):
+        '''
+        Keep cumulative calls, seconds and characters per stage of
+        segmentation (see `jieba._profile`), read with `stats`.
+        '''
+        if self.profiler is None:
+            self.profiler = Profiler()
+
+    def disable_profiling(self):
+        self.profiler = None
+
+    def stats(self):
+        '''The profiling stats, or None if profiling is disabled.'''
+        prof = self.profiler
+        return prof.stats() if prof is not None else None
+
+    def reset_stats(self):
+        prof = self.profiler
+        if prof is not None:
+            prof.reset()
+
+    def _cut_block(self, blk, cut_block, cut_all, HMM, snap):
+        cache = self.block_cache
+        # results from a snapshot still being built by `batch` are not kept
+        if cache is None or snap is not self._snapshot:
+            return cut_block(blk, snap)
+        version = snap.version
+        if self._cache_version != version:
+            cache.clear()
+            self._cache_version = version
+        key = (version, blk, cut_all, HMM)
+        words = cache.get(key)
+        if words is None:
+            words = cut_block(blk, snap)
+            if HMM and not cut_all:
+                # cached with the words of its unknown runs, so that hits
+                # skip the HMM too
+                words = self._resolve_unknown((words,))
+            words = tuple(words)
+            cache.put(key, words, sys.getsizeof(blk) + sys.getsizeof(words) +
+                      sum(map(sys.getsizeof, words)))
+        return words
 
 
 # default Tokenizer instance
@@ -491,14 +1797,29 @@ dt = Tokenizer()
 get_FREQ = lambda k, d=None: dt.FREQ.get(k, d)
 add_word = dt.add_word
 calc = dt.calc
+get_route = dt.get_route
 cut = dt.cut
 lcut = dt.lcut
 cut_for_search = dt.cut_for_search
+cut_batch = dt.cut_batch
+add_words = dt.add_words
+recut = dt.recut
+cut_stream = dt.cut_stream
+cut_offsets = dt.cut_offsets
+enable_profiling = dt.enable_profiling
+disable_profiling = dt.disable_profiling
+stats = dt.stats
+reset_stats = dt.reset_stats
+enable_cache = dt.enable_cache
+disable_cache = dt.disable_cache
+cache_info = dt.cache_info
 lcut_for_search = dt.lcut_for_search
 del_word = dt.del_word
 get_DAG = dt.get_DAG
 get_dict_file = dt.get_dict_file
 initialize = dt.initialize
+wait_initialized = dt.wait_initialized
+wait_cache_written = dt.wait_cache_written
 load_userdict = dt.load_userdict
 set_dictionary = dt.set_dictionary
 suggest_freq = dt.suggest_freq
@@ -550,12 +1871,22 @@ def _pcut_for_search(sentence, HMM=True):
             yield w
 
 
-def enable_parallel(processnum=None):
+def _attach_worker(path):
+    posseg = sys.modules.get('jieba.posseg')
+    if posseg and os.path.isfile(os.path.join(path, posseg.SHARED_MODEL)):
+        posseg.dt.attach(path)
+    else:
+        dt.attach(path)
+
+
+def enable_parallel(processnum=None, shared=None):
     """
     Change the module's `cut` and `cut_for_search` functions to the
     parallel version.
     Note that this only works using dt, custom Tokenizer
     instances are not supported.
+    If `shared` is a directory written by `publish`, the worker processes
+    attach to it instead of keeping their own copies of the tables.
     """
     global pool, dt, cut, cut_for_search
     from multiprocessing import cpu_count
@@ -567,7 +1898,10 @@ def enable_parallel(processnum=None):
     dt.check_initialized()
     if processnum is None:
         processnum = cpu_count()
-    pool = Pool(processnum)
+    if shared:
+        pool = Pool(processnum, _attach_worker, (shared,))
+    else:
+        pool = Pool(processnum)
     cut = _pcut
     cut_for_search = _pcut_for_search
 
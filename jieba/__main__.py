@@ -18,6 +18,8 @@ parser.add_argument("-a", "--cut-all",
                     help="full pattern cutting (ignored with POS tagging)")
 parser.add_argument("-n", "--no-hmm", dest="hmm", action="store_false",
                     default=True, help="don't use the Hidden Markov Model")
+parser.add_argument("--profile", action="store_true", default=False,
+                    help="print the time spent in each stage of segmentation to stderr")
 parser.add_argument("-q", "--quiet", action="store_true", default=False,
                     help="don't print loading messages to stderr")
 parser.add_argument("-V", '--version', action='version',
@@ -48,6 +50,8 @@ else:
     jieba.initialize()
 if args.user_dict:
     jieba.load_userdict(args.user_dict)
+if args.profile:
+    jieba.enable_profiling()
 
 ln = fp.readline()
 while ln:
@@ -59,3 +63,6 @@ while ln:
     ln = fp.readline()
 
 fp.close()
+
+if args.profile:
+    sys.stderr.write(jieba.dt.profiler.report() + '\n')
@@ -2,13 +2,19 @@
 import os
 import sys
 
-try:
-    import pkg_resources
-    get_module_res = lambda *res: pkg_resources.resource_stream(__name__,
-                                                                os.path.join(*res))
-except ImportError:
-    get_module_res = lambda *res: open(os.path.normpath(os.path.join(
-                            os.getcwd(), os.path.dirname(__file__), *res)), 'rb')
+
+def get_module_res(*res):
+    # pkg_resources takes longer to import than all of jieba; it is only
+    # needed when the package is not a directory, e.g. in a zipped egg
+    path = os.path.normpath(os.path.join(os.getcwd(), os.path.dirname(__file__), *res))
+    if not os.path.isfile(path):
+        try:
+            import pkg_resources
+        except ImportError:
+            pass
+        else:
+            return pkg_resources.resource_stream(__name__, os.path.join(*res))
+    return open(path, 'rb')
 
 PY2 = sys.version_info[0] == 2
 
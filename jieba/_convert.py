@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Regenerate the HMM table files shipped with jieba.finalseg and
+jieba.posseg from their prob_*.py modules (or .p pickles):
+
+    python -m jieba._convert [--pickle] [finalseg] [posseg]
+"""
+from __future__ import absolute_import, unicode_literals, print_function
+import os
+import argparse
+from . import _tables
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m jieba._convert',
+        description='Regenerate the HMM table files shipped with jieba.')
+    parser.add_argument('packages', nargs='*', metavar='package',
+                        help='finalseg or posseg, both by default')
+    parser.add_argument('--pickle', action='store_true',
+                        help='convert from the .p pickles instead of the .py modules')
+    args = parser.parse_args(argv)
+    for package in args.packages:
+        if package not in _tables.SOURCES:
+            parser.error('unknown package %r' % package)
+    for package in args.packages or sorted(_tables.SOURCES):
+        path = _tables.convert(package, args.pickle)
+        print('%s: %d bytes' % (path, os.path.getsize(path)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Advisory lock across processes, used so that only one process builds a
+cache file while the others wait for it.
+
+With `fcntl` the lock is a `flock` on the lock file, which the system
+releases when the holder exits, so a crashed builder never leaves it held.
+Elsewhere the lock file is created exclusively and holds the pid of the
+owner; a lock file older than `stale` seconds is taken to be left over by
+a crashed process and removed.
+"""
+from __future__ import absolute_import, unicode_literals
+import os
+import time
+import logging
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+default_logger = logging.getLogger(__name__.rsplit('.', 1)[0])
+
+
+class FileLock(object):
+    '''
+    Exclusive lock on `path`, waiting at most `timeout` seconds (None for
+    no limit). If the lock cannot be taken, because the directory is not
+    writable or the wait timed out, the block runs without it and `locked`
+    is False: the lock only saves duplicate work.
+    '''
+
+    def __init__(self, path, timeout=None, stale=60, poll=0.05):
+        self.path = path
+        self.timeout = timeout
+        self.stale = stale
+        self.poll = poll
+        self.locked = False
+        self._fd = None
+
+    def __repr__(self):
+        return '<FileLock %r locked=%r>' % (self.path, self.locked)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def acquire(self):
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        try:
+            while not self._try_acquire():
+                if deadline is not None and time.time() >= deadline:
+                    default_logger.debug("Timed out waiting for lock %s" % self.path)
+                    return False
+                time.sleep(self.poll)
+        except (IOError, OSError):
+            default_logger.debug("Cannot lock %s, continuing without the lock" % self.path)
+            return False
+        self.locked = True
+        return True
+
+    def _try_acquire(self):
+        if fcntl is not None:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                return False
+            return True
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except (IOError, OSError):
+            if not os.path.exists(self.path):
+                raise
+            self._break_stale()
+            return False
+        os.write(fd, ('%d %f' % (os.getpid(), time.time())).encode('ascii'))
+        os.close(fd)
+        return True
+
+    def _break_stale(self):
+        try:
+            age = time.time() - os.path.getmtime(self.path)
+            if age > self.stale:
+                default_logger.debug("Removing stale lock %s" % self.path)
+                os.remove(self.path)
+        except (IOError, OSError):
+            # released or removed by another process meanwhile
+            pass
+
+    def release(self):
+        if fcntl is not None:
+            if self._fd is not None:
+                if self.locked:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+                os.close(self._fd)
+                self._fd = None
+        elif self.locked:
+            try:
+                os.remove(self.path)
+            except (IOError, OSError):
+                pass
+        self.locked = False
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Least recently used cache bounded by a number of entries (`maxsize`),
+    an estimated size in bytes (`maxbytes`) or both; None means unbounded.
+    Hits and misses are counted for sizing the cache.
+    """
+
+    def __init__(self, maxsize=None, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<LRUCache size=%d bytes=%d hits=%d misses=%d>' % (
+            len(self._data), self.nbytes, self.hits, self.misses)
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                entry = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, nbytes=0):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            if self.maxbytes is not None and nbytes > self.maxbytes:
+                return
+            self._data[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while ((self.maxsize is not None and len(self._data) > self.maxsize) or
+                   (self.maxbytes is not None and self.nbytes > self.maxbytes)):
+                self.nbytes -= self._data.popitem(last=False)[1][1]
+
+    def discard(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self.nbytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def reset_stats(self):
+        self.hits = self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data),
+                'bytes': self.nbytes, 'maxsize': self.maxsize, 'maxbytes': self.maxbytes}
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel segmentation with a pool of worker processes for any `Tokenizer`
+or `POSTokenizer`.
+
+The tokenizer is published once to a temporary directory that every worker
+attaches to, so the workers use its dictionary, including words added to
+it; with the "trie" backend they share one memory map of it, with "dict"
+each copies it into a dict. The HMM tables are copied by each worker
+unless `share_hmm` is set.
+Input is split into jobs of about `chunk_chars` characters at boundaries
+the tokenizer cannot segment across. In accurate mode the workers send back
+word lengths instead of words, which the parent slices out of its own copy
+of the text.
+"""
+from __future__ import absolute_import, unicode_literals
+import shutil
+import tempfile
+from array import array
+from collections import deque
+from ._compat import *
+
+_worker = None
+
+
+def _init_worker(path, backend, matcher, pos, copy_hmm):
+    global _worker
+    import jieba
+    tokenizer = jieba.Tokenizer(backend=backend, matcher=matcher)
+    if pos:
+        import jieba.posseg
+        tokenizer = jieba.posseg.POSTokenizer(tokenizer)
+    tokenizer.attach(path, copy_hmm)
+    _worker = tokenizer
+
+
+def _cut_job(pieces, cut_all, HMM, pos):
+    results = []
+    for piece in pieces:
+        if pos:
+            words = list(_worker.cut(piece, HMM))
+            results.append((array(str('i'), [len(w.word) for w in words]),
+                            [w.flag for w in words]))
+        elif cut_all:
+            results.append(list(_worker.cut(piece, True, HMM)))
+        else:
+            results.append(array(str('i'), [len(w) for w in _worker.cut(piece, False, HMM)]))
+    return results
+
+
+def _split(text, size, safe_boundary):
+    '''Split text into pieces of about `size` characters at safe boundaries.'''
+    start = 0
+    while len(text) - start > size:
+        end = start + size
+        while end > start and not safe_boundary(text, end):
+            end -= 1
+        if end == start:
+            end = start + size
+            while not safe_boundary(text, end):
+                end += 1
+        yield text[start:end]
+        start = end
+    yield text[start:]
+
+
+class ParallelTokenizer(object):
+    '''
+    Segment with a pool of worker processes, giving the same results as
+    the wrapped tokenizer. The pool is started on first use and restarted
+    when the dictionary of the tokenizer has changed since.
+    '''
+
+    def __init__(self, tokenizer=None, processnum=None, chunk_chars=65536, share_hmm=False):
+        '''
+        Parameter:
+            - tokenizer: A Tokenizer or POSTokenizer, the default Tokenizer
+                         if None.
+            - processnum: Number of worker processes, the number of CPUs if None.
+            - chunk_chars: Approximate number of characters per job.
+            - share_hmm: Share the HMM tables between the workers through
+                         memory maps, as the dictionary is. By default each
+                         worker copies them into dicts, which takes more
+                         memory but runs the HMMs about twice as fast.
+        '''
+        import jieba
+        if tokenizer is None:
+            tokenizer = jieba.dt
+        if chunk_chars < 1:
+            raise ValueError('jieba: chunk_chars must be positive')
+        self.tokenizer = tokenizer
+        # the Tokenizer of a POSTokenizer
+        self.base = getattr(tokenizer, 'tokenizer', tokenizer)
+        self.pos = self.base is not tokenizer
+        if processnum is None:
+            from multiprocessing import cpu_count
+            processnum = cpu_count()
+        self.processnum = processnum
+        self.chunk_chars = chunk_chars
+        self.share_hmm = share_hmm
+        self.pool = None
+        self.shared_dir = None
+        self.version = None
+
+    def __repr__(self):
+        return '<ParallelTokenizer %r processnum=%d>' % (self.tokenizer, self.processnum)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        '''Start the pool, or restart it if the dictionary has changed.'''
+        if self.pool is not None and self.version == self.base.dict_version:
+            return self.pool
+        self.close()
+        from multiprocessing import Pool
+        self.base.check_initialized()
+        self.shared_dir = tempfile.mkdtemp(prefix='jieba-')
+        self.tokenizer.publish(self.shared_dir)
+        self.version = self.base.dict_version
+        self.pool = Pool(self.processnum, _init_worker,
+                         (self.shared_dir, self.base.backend, self.base.matcher, self.pos,
+                          not self.share_hmm))
+        return self.pool
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.shared_dir is not None:
+            shutil.rmtree(self.shared_dir, ignore_errors=True)
+            self.shared_dir = None
+
+    def _run(self, texts, cut_all, HMM):
+        '''
+        Yield (index of the text, words of a piece of it) in input order,
+        keeping at most two jobs per worker in flight.
+        '''
+        import jieba
+        pool = self.start()
+        if self.pos:
+            cut_all = False
+            import jieba.posseg
+            pair = jieba.posseg.pair
+        safe_boundary = jieba._safe_boundary_all if cut_all else jieba._safe_boundary
+        inflight = deque()
+
+        def collect():
+            job, result = inflight.popleft()
+            for (idx, piece), words in zip(job, result.get()):
+                if self.pos:
+                    lengths, flags = words
+                    words = []
+                    start = 0
+                    for length, flag in zip(lengths, flags):
+                        words.append(pair(piece[start:start + length], flag))
+                        start += length
+                elif not cut_all:
+                    lengths = words
+                    words = []
+                    start = 0
+                    for length in lengths:
+                        words.append(piece[start:start + length])
+                        start += length
+                yield idx, words
+
+        job = []
+        size = 0
+        for idx, text in enumerate(texts):
+            for piece in _split(strdecode(text), self.chunk_chars, safe_boundary):
+                job.append((idx, piece))
+                size += len(piece)
+                if size >= self.chunk_chars:
+                    inflight.append((job, pool.apply_async(
+                        _cut_job, ([p for _, p in job], cut_all, HMM, self.pos))))
+                    job = []
+                    size = 0
+                    if len(inflight) >= 2 * self.processnum:
+                        for item in collect():
+                            yield item
+        if job:
+            inflight.append((job, pool.apply_async(
+                _cut_job, ([p for _, p in job], cut_all, HMM, self.pos))))
+        while inflight:
+            for item in collect():
+                yield item
+
+    def cut(self, sentence, cut_all=False, HMM=True, offsets=False):
+        '''
+        Segment one, possibly very long, text, yielding words as the jobs
+        finish, in order. The arguments are those of `Tokenizer.cut`
+        (`POSTokenizer.cut` ignores cut_all). With offsets, yield
+        (word, start, end) tuples instead, as `Tokenizer.tokenize` does.
+        '''
+        if cut_all and offsets:
+            raise ValueError("jieba: offsets are not available with cut_all")
+        start = 0
+        for _, words in self._run((sentence,), cut_all, HMM):
+            for word in words:
+                if offsets:
+                    width = len(word.word if self.pos else word)
+                    yield (word, start, start + width)
+                    start += width
+                else:
+                    yield word
+
+    def lcut(self, *args, **kwargs):
+        return list(self.cut(*args, **kwargs))
+
+    def cut_batch(self, texts, cut_all=False, HMM=True):
+        '''
+        Segment an iterable of texts, yielding the list of words of each
+        text in order. Small texts are grouped into one job and large ones
+        split over several.
+        '''
+        current = None
+        words = []
+        for idx, piece_words in self._run(texts, cut_all, HMM):
+            if idx != current:
+                if current is not None:
+                    yield words
+                current = idx
+                words = []
+            words.extend(piece_words)
+        if current is not None:
+            yield words
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Cumulative timings of the stages of segmentation, kept by a `Tokenizer`
+between `enable_profiling` and `disable_profiling`:
+
+    split       splitting the input into blocks and cutting the blocks
+                without Chinese characters
+    get_DAG     finding the dictionary words of the blocks
+    calc        finding the most probable route through the words
+    hmm         `jieba.finalseg` on runs of unknown single characters
+    pos_hmm     the POS tagging HMM of `jieba.posseg` on such runs
+"""
+from __future__ import absolute_import, unicode_literals
+import threading
+from timeit import default_timer as timer
+
+STAGES = ('split', 'get_DAG', 'calc', 'hmm', 'pos_hmm')
+
+
+class Profiler(object):
+    '''Calls, seconds and characters processed per stage.'''
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<Profiler %s>' % ' '.join(
+            '%s=%.3fs' % (stage, entry[1]) for stage, entry in sorted(self.stages.items()))
+
+    def add(self, stage, seconds, chars):
+        with self._lock:
+            entry = self.stages.get(stage)
+            if entry is None:
+                entry = self.stages[stage] = [0, 0.0, 0]
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] += chars
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+
+    def stats(self):
+        '''
+        {'stages': {stage: {'calls', 'seconds', 'chars'}}, 'hmm_fallback_rate'},
+        the rate being the fraction of the characters looked up in the
+        dictionary that were then passed to an HMM.
+        '''
+        with self._lock:
+            stages = dict((stage, {'calls': calls, 'seconds': seconds, 'chars': chars})
+                          for stage, (calls, seconds, chars) in self.stages.items())
+        looked_up = stages.get('get_DAG', {}).get('chars', 0)
+        hmm = sum(stages.get(stage, {}).get('chars', 0) for stage in ('hmm', 'pos_hmm'))
+        return {'stages': stages,
+                'hmm_fallback_rate': float(hmm) / looked_up if looked_up else 0.0}
+
+    def report(self):
+        '''The stats as a table, one line per stage.'''
+        stats = self.stats()
+        stages = stats['stages']
+        total = sum(entry['seconds'] for entry in stages.values()) or 1.0
+        lines = ['%-8s %10s %10s %6s %12s' % ('stage', 'calls', 'seconds', '%', 'chars')]
+        for stage in STAGES + tuple(sorted(set(stages) - set(STAGES))):
+            if stage in stages:
+                entry = stages[stage]
+                lines.append('%-8s %10d %10.3f %6.1f %12d' % (
+                    stage, entry['calls'], entry['seconds'],
+                    100 * entry['seconds'] / total, entry['chars']))
+        lines.append('HMM fallback rate: %.2f%%' % (100 * stats['hmm_fallback_rate']))
+        return '\n'.join(lines)
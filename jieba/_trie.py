@@ -0,0 +1,748 @@
+# -*- coding: utf-8 -*-
+"""
+Binary dictionary cache format and the compact trie read from it.
+
+A cache file is a fixed header followed by 8-byte aligned arrays:
+
+    header      magic, format version, byte order mark, md5 of the source
+                dictionary, total frequency, node count, string table size,
+                size of the tag names, sub-word count
+    root[cp]    child of the root for BMP code point cp
+    first[n]    children of node n are first[n] .. first[n + 1] - 1
+    label[n]    code point of the last character of node n
+    freq[n]     word frequency, 0 for a prefix-only node
+    logf[n]     log(freq[n] or 1); log-probabilities are logf - log(total)
+    offset[n]   start of node n in the string table
+    tag[n]      POS tag of node n as an index into the tag names, 0 for none;
+                the USER_TAG bit marks a tag set by a user dictionary
+    fail[n]     Aho-Corasick failure link: the node of the longest proper
+                suffix of node n, 0 if none
+    out[n]      dictionary suffix link: the node of the longest proper
+                suffix of node n with a frequency, 0 if none
+    gram_first[n]  the sub-words of node n are grams[gram_first[n]] ..
+                grams[gram_first[n + 1] - 1]
+    grams[g]    the in-dictionary 2-grams and 3-grams of the node strings,
+                in the order search mode yields them, each as
+                4 * start + length
+    strings     UTF-32-LE concatenation of all node strings
+    tag names   newline separated UTF-8 tag names, the first one empty
+
+All prefixes of all dictionary words are nodes, node 0 being the empty
+root. Nodes are sorted by (length, word), which makes the string table
+sorted and lays the trie out breadth first: the children of a node are
+contiguous and sorted by code point.
+
+The file is memory-mapped read-only, so opening it costs no parsing and
+every process using the same cache file shares one copy of it. The
+failure and dictionary suffix links turn the trie into an Aho-Corasick
+automaton that finds every dictionary word in a text in a single pass.
+"""
+from __future__ import absolute_import, unicode_literals
+import mmap
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from itertools import accumulate, chain, compress, repeat
+from math import log
+from operator import itemgetter, lt
+from ._compat import *
+
+MAGIC = b'JIEBADCT'
+FORMAT_VERSION = 6
+BYTE_ORDER_MARK = 0x01020304
+HEADER = struct.Struct('=8sII16sqqqqq')
+ROOT_SIZE = 0x10000
+USER_TAG = 0x8000
+# recent changes to a TrieFreq (or a LayeredFreq) that `layer` copies at
+# least, before merging them into the base dicts
+COMPACT_MIN = 256
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _layout(n, chars, tag_bytes, gram_count):
+    """
+    Byte offsets of the (root, first, label, freq, logf, offset, tag, fail,
+    out, gram_first, grams, strings, tag names) arrays for n nodes whose
+    strings have `chars` characters in total and `gram_count` sub-words,
+    followed by the end of the file.
+    """
+    offsets = [_align(HEADER.size)]
+    for size in (4 * ROOT_SIZE, 4 * (n + 1), 4 * n, 8 * n, 8 * n, 4 * (n + 1),
+                 2 * n, 4 * n, 4 * n, 4 * (n + 1), 4 * gram_count, 4 * chars):
+        offsets.append(_align(offsets[-1] + size))
+    offsets.append(offsets[-1] + tag_bytes)
+    return offsets
+
+
+def dumps(lfreq, total, digest, tags=None, user_tags=None):
+    """
+    Serialize a prefix dict as built by `Tokenizer.gen_pfdict`, i.e. every
+    word and every prefix of every word as a key, into the cache format,
+    returned as a bytearray. `digest` is the md5 digest of the source
+    dictionary and `tags` an optional dict-like object mapping words to POS
+    tags. The tags in `user_tags` take precedence and are marked as set by
+    a user dictionary.
+
+    This runs on a cold start, so the passes over the nodes are made with
+    map, zip and itertools rather than Python loops where they can be.
+    """
+    keys = sorted(lfreq)
+    keys.sort(key=len)
+    keys.insert(0, '')
+    n = len(keys)
+    words = keys[1:]
+    index = dict(zip(keys, xrange(n)))
+    label = array('I', [0])
+    label.extend(map(ord, map(itemgetter(-1), words)))
+    freq = array('q', [0])
+    freq.extend(map(lfreq.__getitem__, words))
+    # there are far fewer distinct frequencies than nodes
+    logs = dict((f, log(f or 1)) for f in set(freq))
+    logf = array('d', map(logs.__getitem__, freq))
+    # the children of the nodes before a node come before its own, in the
+    # order of their parents
+    children = Counter(map(index.__getitem__, map(itemgetter(slice(None, -1)), words)))
+    first = array('i', accumulate(chain((1,), map(children.get, xrange(n), repeat(0)))))
+    del children, words
+    root = array('i', [0]) * ROOT_SIZE
+    for i in xrange(first[0], first[1]):
+        if label[i] < ROOT_SIZE:
+            root[label[i]] = i
+
+    fail, out = _links(keys, index, freq)
+
+    tag = array('H', [0]) * n
+    tag_names = ['']
+    if tags or user_tags:
+        node_tags = list(map(tags.get, keys)) if tags else []
+        tag_index = {}
+        for t in chain(filter(None, node_tags),
+                       filter(None, itervalues(user_tags)) if user_tags else ()):
+            if t not in tag_index:
+                tag_index[t] = len(tag_names)
+                tag_names.append(t)
+        if node_tags:
+            tag = array('H', map(tag_index.get, node_tags, repeat(0)))
+        del node_tags
+        for w, t in iteritems(user_tags or {}):
+            i = index.get(w)
+            if t and i is not None:
+                tag[i] = tag_index[t] | USER_TAG
+    tag_names = '\n'.join(tag_names).encode('utf-8')
+    # the largest structure here, not needed any more
+    del index
+
+    gram_first, grams = _grams(keys, lfreq)
+
+    offset = array('I', [0])
+    offset.extend(accumulate(map(len, keys)))
+    strings = ''.join(keys).encode('utf-32-le')
+
+    layout = _layout(n, offset[-1], len(tag_names), len(grams))
+    buf = bytearray(layout[-1])
+    HEADER.pack_into(buf, 0, MAGIC, FORMAT_VERSION, BYTE_ORDER_MARK,
+                     digest, total, n, offset[-1], len(tag_names), len(grams))
+    for start, arr in zip(layout, (root, first, label, freq, logf, offset, tag,
+                                   fail, out, gram_first, grams)):
+        buf[start:start + len(arr) * arr.itemsize] = memoryview(arr).cast('B')
+    buf[layout[-3]:layout[-3] + len(strings)] = strings
+    buf[layout[-2]:] = tag_names
+    return buf
+
+
+def _links(keys, index, freq):
+    """
+    Failure and dictionary suffix links of the trie. The node strings are
+    all the prefixes of the words, so the failure link of a node is the
+    node of the longest proper suffix of its string that is a key of
+    `index`. The breadth first node order guarantees that the links of
+    shorter nodes are known when a node is reached.
+    """
+    n = len(keys)
+    fail = array('i', map(index.get, map(itemgetter(slice(1, None)), keys), repeat(-1)))
+    for node in compress(xrange(n), map(lt, fail, repeat(0))):
+        w = keys[node]
+        j = 2
+        while w[j:] not in index:
+            j += 1
+        fail[node] = index[w[j:]]
+    out = array('i', [0]) * n
+    for node in xrange(1, n):
+        target = fail[node]
+        out[node] = target if freq[target] else out[target]
+    return fail, out
+
+
+def _grams(keys, lfreq):
+    """
+    The sub-word index: for every node string longer than two characters,
+    the 2-grams and, if it is longer than three, the 3-grams with a
+    frequency, in the order of `TrieFreq.search_grams`. The nodes are
+    sorted by length, so the nodes of each length are looked up one gram
+    position at a time.
+    """
+    lengths = list(map(len, keys))
+    counts = [0] * bisect_right(lengths, 2)
+    grams = array('I')
+    for N in xrange(3, lengths[-1] + 1):
+        block = keys[bisect_left(lengths, N):bisect_right(lengths, N)]
+        codes = [4 * i + 2 for i in xrange(N - 1)]
+        if N > 3:
+            codes.extend(4 * i + 3 for i in xrange(N - 2))
+        hits = [list(map(bool, map(lfreq.get, map(itemgetter(slice(v >> 2, (v >> 2) + (v & 3))),
+                                                   block))))
+                for v in codes]
+        grams.extend(compress(chain.from_iterable(repeat(codes, len(block))),
+                              chain.from_iterable(zip(*hits))))
+        counts.extend(map(sum, zip(*hits)))
+    gram_first = array('I', [0])
+    gram_first.extend(accumulate(counts))
+    return gram_first, grams
+
+
+def read_header(source):
+    """
+    Return (digest, total, node count, string table size, tag names size,
+    sub-word count) of a cache file or buffer, raising ValueError if it is
+    not a cache file of the current format version.
+    """
+    magic, version, bom, digest, total, n, chars, tag_bytes, gram_count = HEADER.unpack_from(source, 0)
+    if magic != MAGIC:
+        raise ValueError('jieba: not a dictionary cache file')
+    if version != FORMAT_VERSION or bom != BYTE_ORDER_MARK:
+        raise ValueError('jieba: incompatible dictionary cache format')
+    if len(source) < _layout(n, chars, tag_bytes, gram_count)[-1]:
+        raise ValueError('jieba: truncated dictionary cache file')
+    return digest, total, n, chars, tag_bytes, gram_count
+
+
+class CompactTrie(object):
+    """
+    Read-only view over a dictionary cache. `source` is either the path of
+    a cache file, which is memory-mapped, or a bytes-like object. If
+    `digest` is given, a cache built from other dictionary content is
+    rejected with ValueError.
+    """
+
+    def __init__(self, source, digest=None):
+        if isinstance(source, string_types):
+            with open(source, 'rb') as f:
+                source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = source
+        buf = memoryview(source)
+        self.digest, self.total, n, chars, tag_bytes, gram_count = read_header(buf)
+        if digest is not None and digest != self.digest:
+            raise ValueError('jieba: dictionary cache is out of date')
+        (root, first, label, freq, logf, offset, tag, fail, out, gram_first,
+         grams, strings, tag_names, end) = _layout(n, chars, tag_bytes, gram_count)
+        self.node_count = n
+        self.root = buf[root:first].cast('i')
+        self.first = buf[first:first + 4 * (n + 1)].cast('i')
+        self.label = buf[label:label + 4 * n].cast('I')
+        self.freq = buf[freq:freq + 8 * n].cast('q')
+        self.logf = buf[logf:logf + 8 * n].cast('d')
+        self.offset = buf[offset:offset + 4 * (n + 1)].cast('I')
+        self.tag = buf[tag:tag + 2 * n].cast('H')
+        self.fail = buf[fail:fail + 4 * n].cast('i')
+        self.out = buf[out:out + 4 * n].cast('i')
+        self.gram_first = buf[gram_first:gram_first + 4 * (n + 1)].cast('I')
+        self.grams = buf[grams:grams + 4 * gram_count].cast('I')
+        self.strings = buf[strings:strings + 4 * chars]
+        self.tag_names = bytes(buf[tag_names:end]).decode('utf-8').split('\n')
+
+    def word(self, node):
+        """The string of `node`, decoded from the string table."""
+        return bytes(self.strings[4 * self.offset[node]:4 * self.offset[node + 1]]).decode('utf-32-le')
+
+    def words(self):
+        """The strings of all nodes but the root, in node order."""
+        text = bytes(self.strings).decode('utf-32-le')
+        offset = self.offset.tolist()
+        return [text[offset[i]:offset[i + 1]] for i in xrange(1, self.node_count)]
+
+    def to_dict(self):
+        """The prefix dict `Tokenizer.gen_pfdict` would build."""
+        return dict(zip(self.words(), self.freq[1:].tolist()))
+
+    def has_tags(self):
+        return len(self.tag_names) > 1
+
+    def user_tags(self):
+        """The tags marked as set by a user dictionary, as a dict."""
+        return dict((self.word(node), self.tag_names[t & ~USER_TAG])
+                    for node, t in enumerate(self.tag.tolist()) if t & USER_TAG)
+
+    def child(self, node, ch):
+        """Return the child of `node` labelled `ch`, or -1."""
+        cp = ord(ch)
+        if not node and cp < ROOT_SIZE:
+            return self.root[cp] or -1
+        hi = self.first[node + 1]
+        i = bisect_left(self.label, cp, self.first[node], hi)
+        if i == hi or self.label[i] != cp:
+            return -1
+        return i
+
+    def find(self, word, start=0, end=None):
+        """Return the node of `word[start:end]`, or -1."""
+        if end is None:
+            end = len(word)
+        if start >= end:
+            return 0
+        node = self.child(0, word[start])
+        first = self.first
+        label = self.label
+        for i in xrange(start + 1, end):
+            if node < 0:
+                break
+            cp = ord(word[i])
+            hi = first[node + 1]
+            node = bisect_left(label, cp, first[node], hi)
+            if node == hi or label[node] != cp:
+                node = -1
+        return node
+
+
+class TrieFreq(object):
+    """
+    Dict-like replacement for `Tokenizer.FREQ` backed by a `CompactTrie`.
+
+    The trie itself is read-only. Frequencies changed by `add_word` are kept
+    in `override` (keyed by node) for words already in the trie, and in
+    `extra` (keyed by word) for new words and their new prefixes.
+    `new_words` tells whether a word unknown to the automaton links of the
+    trie has been given a frequency since.
+
+    Every word has an id: its node for words in the trie, and ids from
+    `trie.node_count` upward, kept in `extra_ids`, for the words in `extra`.
+    `weights` holds log(freq or 1) for the ids whose frequency differs from
+    `trie.logf`, so that `calc_ids` needs neither substrings nor logarithms.
+
+    Each of these overlay dicts only holds the changes made since the last
+    compaction; the older ones are in the `base_` dict of the same name,
+    which is never changed and is shared by the TrieFreqs made by `layer`.
+    """
+
+    def __init__(self, trie):
+        self.trie = trie
+        self.override = {}
+        self.extra = {}
+        self.extra_ids = {}
+        self.weights = {}
+        self.base_override = {}
+        self.base_extra = {}
+        self.base_extra_ids = {}
+        self.base_weights = {}
+        self.new_words = False
+        self.next_id = trie.node_count
+
+    def layer(self):
+        """
+        A TrieFreq to make changes to, leaving this one as it is. It shares
+        the trie and the base dicts and copies the recent changes, unless
+        there are more of them than COMPACT_MIN and the square root of the
+        size of the base, in which case both are merged into new base dicts.
+        """
+        other = TrieFreq(self.trie)
+        changes = len(self.override) + len(self.extra)
+        base = len(self.base_override) + len(self.base_extra)
+        if changes > max(COMPACT_MIN, int(base ** 0.5)):
+            for name in ('override', 'extra', 'extra_ids', 'weights'):
+                merged = getattr(self, 'base_' + name).copy()
+                merged.update(getattr(self, name))
+                setattr(other, 'base_' + name, merged)
+        else:
+            other.override = self.override.copy()
+            other.extra = self.extra.copy()
+            other.extra_ids = self.extra_ids.copy()
+            other.weights = self.weights.copy()
+            other.base_override = self.base_override
+            other.base_extra = self.base_extra
+            other.base_extra_ids = self.base_extra_ids
+            other.base_weights = self.base_weights
+        other.new_words = self.new_words
+        other.next_id = self.next_id
+        return other
+
+    def __repr__(self):
+        return '<TrieFreq nodes=%d extra=%d>' % (self.trie.node_count, len(self) - self.trie.node_count + 1)
+
+    def __len__(self):
+        base_extra = self.base_extra
+        return (self.trie.node_count - 1 + len(base_extra) +
+                sum(1 for word in self.extra if word not in base_extra))
+
+    def __iter__(self):
+        for word in self.trie.words():
+            yield word
+        for word in self.base_extra:
+            yield word
+        for word in self.extra:
+            if word not in self.base_extra:
+                yield word
+
+    def __contains__(self, word):
+        return self.trie.find(word) > 0 or word in self.extra or word in self.base_extra
+
+    def __getitem__(self, word):
+        node = self.trie.find(word)
+        if node > 0:
+            freq = self.override.get(node)
+            if freq is None:
+                freq = self.base_override.get(node, self.trie.freq[node])
+            return freq
+        freq = self.extra.get(word)
+        if freq is None:
+            freq = self.base_extra[word]
+        return freq
+
+    def __setitem__(self, word, freq):
+        self._set(self.trie.find(word), word, freq)
+
+    def _set(self, node, word, freq):
+        if freq and not (node > 0 and self.trie.freq[node]):
+            self.new_words = True
+        if node > 0:
+            self.override[node] = freq
+        else:
+            self.extra[word] = freq
+            node = self.extra_ids.get(word) or self.base_extra_ids.get(word)
+            if node is None:
+                node = self.extra_ids[word] = self.next_id
+                self.next_id += 1
+        self.weights[node] = log(freq or 1)
+
+    def merge(self, words):
+        """
+        Set the frequency of every (word, freq) pair in turn and add the
+        prefixes of the word that are missing with a frequency of 0, as
+        `Tokenizer.add_word` does, walking the trie once per word.
+        """
+        trie = self.trie
+        first = trie.first
+        label = trie.label
+        extra = self.extra
+        base_extra = self.base_extra
+        extra_ids = self.extra_ids
+        weights = self.weights
+        for word, freq in words:
+            N = len(word)
+            node = trie.child(0, word[0]) if N else -1
+            i = 0
+            while node > 0:
+                i += 1
+                if i == N:
+                    break
+                cp = ord(word[i])
+                hi = first[node + 1]
+                child = bisect_left(label, cp, first[node], hi)
+                if child == hi or label[child] != cp:
+                    break
+                node = child
+            self._set(node if i == N else -1, word, freq)
+            # the prefixes up to word[:i] are nodes of the trie, and those
+            # of an extra word are extra words too
+            for j in xrange(N - 1, i, -1):
+                frag = word[:j]
+                if frag in extra or frag in base_extra:
+                    break
+                # _set of a new extra word with a frequency of 0
+                extra[frag] = 0
+                extra_ids[frag] = self.next_id
+                weights[self.next_id] = 0.0
+                self.next_id += 1
+
+    def get(self, word, default=None):
+        node = self.trie.find(word)
+        if node > 0:
+            freq = self.override.get(node)
+            if freq is None:
+                freq = self.base_override.get(node, self.trie.freq[node])
+            return freq
+        freq = self.extra.get(word)
+        if freq is None:
+            freq = self.base_extra.get(word, default)
+        return freq
+
+    def items(self):
+        freqs = self.trie.freq.tolist()
+        for override in (self.base_override, self.override):
+            for node, freq in iteritems(override):
+                freqs[node] = freq
+        result = list(zip(self.trie.words(), freqs[1:]))
+        extra = self.base_extra.copy()
+        extra.update(self.extra)
+        result.extend(iteritems(extra))
+        return result
+
+    def span_freqs(self, sentence, start, ends):
+        """
+        Frequencies of `sentence[start:x + 1]` for every x in the ascending
+        list `ends`, with None for fragments that are not in the dictionary.
+        """
+        trie = self.trie
+        override = self.override
+        base_override = self.base_override
+        extra = self.extra
+        base_extra = self.base_extra
+        result = []
+        node = 0
+        x = start
+        for end in ends:
+            while x <= end and node >= 0:
+                node = trie.child(node, sentence[x])
+                x += 1
+            if node > 0:
+                f = override.get(node)
+                result.append(base_override.get(node, trie.freq[node]) if f is None else f)
+            elif extra or base_extra:
+                frag = sentence[start:end + 1]
+                f = extra.get(frag)
+                result.append(base_extra.get(frag) if f is None else f)
+            else:
+                result.append(None)
+        return result
+
+    def get_DAG(self, sentence, ids=None):
+        """
+        The DAG of `sentence` as `Tokenizer.get_DAG` builds it. If a dict
+        `ids` is given, it receives the word ids of the DAG edges: ids[k][i]
+        is the id of sentence[k:DAG[k][i] + 1], 0 for a fragment that is not
+        a word.
+        """
+        root = self.trie.root
+        first = self.trie.first
+        label = self.trie.label
+        freq = self.trie.freq
+        override = self.override
+        base_override = self.base_override
+        overridden = bool(override or base_override)
+        extra = self.extra
+        base_extra = self.base_extra
+        extended = bool(extra or base_extra)
+        if ids is None and not (overridden or extended):
+            return self._get_DAG_ends(sentence)
+        DAG = {}
+        if ids is None:
+            ids = {}
+        N = len(sentence)
+        for k in xrange(N):
+            tmplist = []
+            tmpids = []
+            i = k
+            cp = ord(sentence[k])
+            if cp < ROOT_SIZE:
+                node = root[cp] or -1
+            else:
+                node = self.trie.child(0, sentence[k])
+            while i < N:
+                if node > 0:
+                    f = freq[node]
+                    if overridden:
+                        f = override.get(node, base_override.get(node, f))
+                    wid = node
+                elif extended:
+                    frag = sentence[k:i + 1]
+                    f = extra.get(frag)
+                    if f is None:
+                        f = base_extra.get(frag)
+                        if f is None:
+                            break
+                        wid = self.base_extra_ids[frag]
+                    else:
+                        wid = self.extra_ids.get(frag) or self.base_extra_ids[frag]
+                else:
+                    break
+                if f:
+                    tmplist.append(i)
+                    tmpids.append(wid)
+                i += 1
+                if node > 0 and i < N:
+                    cp = ord(sentence[i])
+                    hi = first[node + 1]
+                    node = bisect_left(label, cp, first[node], hi)
+                    if node == hi or label[node] != cp:
+                        node = -1
+            if not tmplist:
+                tmplist.append(k)
+                tmpids.append(0)
+            DAG[k] = tmplist
+            ids[k] = tmpids
+        return DAG
+
+    def _get_DAG_ends(self, sentence):
+        """
+        `get_DAG` without word ids while no word has been changed, as full
+        mode and `Tokenizer.get_DAG` use it: only the trie is walked, and a
+        walk stops at a node without children rather than searching them.
+        """
+        trie = self.trie
+        root = trie.root
+        first = trie.first
+        label = trie.label
+        freq = trie.freq
+        DAG = {}
+        N = len(sentence)
+        for k in xrange(N):
+            cp = ord(sentence[k])
+            node = root[cp] if cp < ROOT_SIZE else max(trie.child(0, sentence[k]), 0)
+            tmplist = []
+            i = k
+            while node:
+                if freq[node]:
+                    tmplist.append(i)
+                i += 1
+                lo = first[node]
+                hi = first[node + 1]
+                if i == N or lo == hi:
+                    break
+                cp = ord(sentence[i])
+                node = bisect_left(label, cp, lo, hi)
+                if node == hi or label[node] != cp:
+                    break
+            DAG[k] = tmplist or [k]
+        return DAG
+
+    def get_DAG_automaton(self, sentence, ids=None):
+        """
+        Same as `get_DAG`, but finds the words with the Aho-Corasick automaton
+        of the trie in one left-to-right pass over `sentence`, reporting at
+        every position the words that end there. Falls back to `get_DAG` once
+        words the automaton does not know about have been added.
+        """
+        if self.new_words:
+            return self.get_DAG(sentence, ids)
+        trie = self.trie
+        root = trie.root
+        first = trie.first
+        label = trie.label
+        freq = trie.freq
+        fail = trie.fail
+        out = trie.out
+        offset = trie.offset
+        override = self.override
+        base_override = self.base_override
+        overridden = bool(override or base_override)
+        N = len(sentence)
+        ends = [[] for _ in xrange(N)]
+        nodes = [[] for _ in xrange(N)]
+        state = 0
+        for i in xrange(N):
+            cp = ord(sentence[i])
+            while state:
+                hi = first[state + 1]
+                node = bisect_left(label, cp, first[state], hi)
+                if node < hi and label[node] == cp:
+                    state = node
+                    break
+                state = fail[state]
+            else:
+                state = root[cp] if cp < ROOT_SIZE else max(trie.child(0, sentence[i]), 0)
+            node = state if freq[state] else out[state]
+            while node:
+                if not overridden or override.get(node, base_override.get(node, 1)):
+                    k = i + 1 - offset[node + 1] + offset[node]
+                    ends[k].append(i)
+                    nodes[k].append(node)
+                node = out[node]
+        DAG = {}
+        for k in xrange(N):
+            DAG[k] = ends[k] or [k]
+            if ids is not None:
+                ids[k] = nodes[k] or [0]
+        return DAG
+
+    def calc(self, sentence, DAG, route, total):
+        N = len(sentence)
+        route[N] = (0, 0)
+        logtotal = log(total)
+        for idx in xrange(N - 1, -1, -1):
+            ends = DAG[idx]
+            route[idx] = max((log(f or 1) - logtotal + route[x + 1][0], x)
+                             for x, f in zip(ends, self.span_freqs(sentence, idx, ends)))
+
+    def calc_ids(self, DAG, ids, route, total):
+        """`calc` for a DAG whose word ids were collected by `get_DAG`."""
+        N = len(DAG)
+        route[N] = (0, 0)
+        logtotal = log(total)
+        logf = self.trie.logf
+        weights = self.weights
+        base_weights = self.base_weights
+        for idx in xrange(N - 1, -1, -1):
+            ends = DAG[idx]
+            if len(ends) == 1:
+                x = ends[0]
+                wid = ids[idx][0]
+                route[idx] = ((weights[wid] if wid in weights else
+                               base_weights[wid] if wid in base_weights else logf[wid]) -
+                              logtotal + route[x + 1][0], x)
+            else:
+                route[idx] = max(((weights[wid] if wid in weights else
+                                   base_weights[wid] if wid in base_weights else logf[wid]) -
+                                  logtotal + route[x + 1][0], x)
+                                 for x, wid in zip(ends, ids[idx]))
+
+    def search_grams(self, word):
+        """
+        (start, end) offsets of the in-dictionary 2-grams and 3-grams of
+        `word`, in the order `Tokenizer.cut_for_search` yields them.
+        """
+        N = len(word)
+        if N <= 2:
+            return []
+        if not (self.override or self.extra or self.base_override or self.base_extra):
+            # the precomputed sub-words of the word, if it is in the trie
+            node = self.trie.find(word)
+            if node > 0:
+                trie = self.trie
+                return [(v >> 2, (v >> 2) + (v & 3))
+                        for v in trie.grams[trie.gram_first[node]:trie.gram_first[node + 1]]]
+        grams = []
+        for n in ((2, 3) if N > 3 else (2,)):
+            for i in xrange(N - n + 1):
+                if self.span_freqs(word, i, (i + n - 1,))[0]:
+                    grams.append((i, i + n))
+        return grams
+
+
+class TrieTags(object):
+    """
+    Dict-like POS tag table reading the tags stored in a `CompactTrie`,
+    with tags set later (e.g. for user words) kept in `overlay`.
+    """
+
+    def __init__(self, trie):
+        self.trie = trie
+        self.overlay = {}
+
+    def __repr__(self):
+        return '<TrieTags tags=%d overlay=%d>' % (len(self.trie.tag_names) - 1, len(self.overlay))
+
+    def __contains__(self, word):
+        return self.get(word) is not None
+
+    def __getitem__(self, word):
+        tag = self.get(word)
+        if tag is None:
+            raise KeyError(word)
+        return tag
+
+    def __setitem__(self, word, tag):
+        self.overlay[word] = tag
+
+    def update(self, tags):
+        self.overlay.update(tags)
+
+    def get(self, word, default=None):
+        tag = self.overlay.get(word)
+        if tag is not None:
+            return tag
+        node = self.trie.find(word)
+        if node > 0 and self.trie.tag[node]:
+            return self.trie.tag_names[self.trie.tag[node] & ~USER_TAG]
+        return default
@@ -4,9 +4,31 @@ import os
 import sys
 import pickle
 from .._compat import *
+from .. import _tables
+
+# numpy, optional and slower to import than the rest of jieba, is imported
+# by the first viterbi_batch call; None if it is not installed
+numpy = None
+_numpy_checked = False
+
+
+def _import_numpy():
+    global numpy, _numpy_checked
+    if not _numpy_checked:
+        try:
+            import numpy
+        except ImportError:
+            pass
+        _numpy_checked = True
+    return numpy
+
 
 MIN_FLOAT = -3.14e100
 
+# below this many sentences, setting up the numpy arrays of viterbi_batch
+# costs more than decoding them one by one
+NUMPY_MIN_BATCH = 24
+
 PROB_START_P = "prob_start.p"
 PROB_TRANS_P = "prob_trans.p"
 PROB_EMIT_P = "prob_emit.p"
@@ -26,39 +48,125 @@ def load_model():
     emit_p = pickle.load(get_module_res("finalseg", PROB_EMIT_P))
     return start_p, trans_p, emit_p
 
-if sys.platform.startswith("java"):
-    start_P, trans_P, emit_P = load_model()
-else:
-    from .prob_start import P as start_P
-    from .prob_trans import P as trans_P
-    from .prob_emit import P as emit_P
+
+# The tables, loaded on first use, and the cache of the words of recently
+# cut sentences (see jieba._tables.Model); Tokenizer.add_word discards the
+# words it adds, which are no longer cut with the HMM.
+_model = _tables.Model('finalseg', globals(), ('start_P', 'trans_P', 'emit_P'))
+check_model_loaded = _model.check_loaded
+__getattr__ = _model.getattr
+dumps_model = _model.dumps
+attach_model = _model.attach
+set_cache_size = _model.set_cache_size
+cache_info = _model.cache_info
+clear_cache = _model.clear_cache
+discard = _model.discard
+
+
+def set_model(start_p, trans_p, emit_p):
+    _model.set(start_p, trans_p, emit_p)
 
 
 def viterbi(obs, states, start_p, trans_p, emit_p):
-    V = [{}]  # tabular
-    path = {}
+    V = {}
     for y in states:  # init
-        V[0][y] = start_p[y] + emit_p[y].get(obs[0], MIN_FLOAT)
-        path[y] = [y]
+        V[y] = start_p[y] + emit_p[y].get(obs[0], MIN_FLOAT)
+    # back[t - 1][y] is the best state before y at position t
+    back = []
     for t in xrange(1, len(obs)):
-        V.append({})
-        newpath = {}
+        newV = {}
+        ptr = {}
         for y in states:
             em_p = emit_p[y].get(obs[t], MIN_FLOAT)
             (prob, state) = max(
-                [(V[t - 1][y0] + trans_p[y0].get(y, MIN_FLOAT) + em_p, y0) for y0 in PrevStatus[y]])
-            V[t][y] = prob
-            newpath[y] = path[state] + [y]
-        path = newpath
+                [(V[y0] + trans_p[y0].get(y, MIN_FLOAT) + em_p, y0) for y0 in PrevStatus[y]])
+            newV[y] = prob
+            ptr[y] = state
+        V = newV
+        back.append(ptr)
 
-    (prob, state) = max((V[len(obs) - 1][y], y) for y in 'ES')
+    (prob, state) = max((V[y], y) for y in 'ES')
 
-    return (prob, path[state])
+    path = [state]
+    for ptr in reversed(back):
+        state = ptr[state]
+        path.append(state)
+    path.reverse()
+    return (prob, path)
 
 
-def __cut(sentence):
-    global emit_P
-    prob, pos_list = viterbi(sentence, 'BMES', start_P, trans_P, emit_P)
+def viterbi_batch(sentences, batch_size=256):
+    '''
+    The BMES states of each of `sentences` as a string, the same as the
+    path `viterbi` finds. With numpy, sentences of similar length are
+    padded into batches of up to `batch_size` and decoded together with
+    array operations; without it, or for fewer than NUMPY_MIN_BATCH
+    sentences, they are decoded one by one.
+    '''
+    check_model_loaded()
+    if len(sentences) < NUMPY_MIN_BATCH or _import_numpy() is None:
+        return [''.join(viterbi(sentence, 'BMES', start_P, trans_P, emit_P)[1])
+                for sentence in sentences]
+    results = [None] * len(sentences)
+    order = sorted(xrange(len(sentences)), key=lambda i: len(sentences[i]))
+    for i in xrange(0, len(order), batch_size):
+        batch = [sentences[j] for j in order[i:i + batch_size]]
+        for j, states in zip(order[i:i + batch_size], _viterbi_numpy(batch)):
+            results[j] = states
+    return results
+
+
+STATES = 'BMES'
+# for every state, the indexes of the two states that can precede it and
+# whether the second one wins a tie, as it does in max() over (prob, state)
+_PREV_INDEX = [(STATES.index(a), STATES.index(b), b > a)
+               for a, b in (PrevStatus[y] for y in STATES)]
+
+
+def _viterbi_numpy(sentences):
+    '''
+    Decode non-empty sentences padded to one batch. Each step adds the
+    probabilities in the order `viterbi` does, so the results are equal.
+    '''
+    lengths = numpy.array([len(s) for s in sentences])
+    B, L = len(sentences), int(lengths.max())
+    chars = {}
+    obs = numpy.zeros((B, L), dtype=numpy.intp)
+    for b, sentence in enumerate(sentences):
+        obs[b, :len(sentence)] = [chars.setdefault(ch, len(chars)) for ch in sentence]
+    columns = sorted(chars, key=chars.get)
+    emit = numpy.array([[emit_P[y].get(ch, MIN_FLOAT) for ch in columns] for y in STATES]).T
+    trans = numpy.array([[trans_P[y0].get(y, MIN_FLOAT) for y in STATES] for y0 in STATES])
+    start = numpy.array([start_P[y] for y in STATES])
+
+    V = start + emit[obs[:, 0]]
+    back = numpy.zeros((L, B, 4), dtype=numpy.int8)
+    newV = numpy.empty((B, 4))
+    for t in xrange(1, L):
+        em = emit[obs[:, t]]
+        for y, (a, b, second_wins_tie) in enumerate(_PREV_INDEX):
+            pa = V[:, a] + trans[a, y] + em[:, y]
+            pb = V[:, b] + trans[b, y] + em[:, y]
+            take_b = pb >= pa if second_wins_tie else pb > pa
+            newV[:, y] = numpy.where(take_b, pb, pa)
+            back[t, :, y] = numpy.where(take_b, b, a)
+        # finished sentences keep the probabilities of their last position
+        active = lengths > t
+        V[active] = newV[active]
+
+    E, S = STATES.index('E'), STATES.index('S')
+    state = numpy.where(V[:, S] >= V[:, E], S, E)
+    path = numpy.empty((B, L), dtype=numpy.int8)
+    rows = numpy.arange(B)
+    for t in xrange(L - 1, -1, -1):
+        path[:, t] = state
+        if t:
+            state = numpy.where(lengths > t, back[t, rows, state], state)
+    return [''.join(STATES[k] for k in path[b, :lengths[b]].tolist()) for b in xrange(B)]
+
+
+def _states_to_words(sentence, pos_list):
+    '''Cut sentence at the word ends of its BMES states.'''
     begin, nexti = 0, 0
     # print pos_list, sentence
     for i, char in enumerate(sentence):
@@ -74,12 +182,16 @@ def __cut(sentence):
     if nexti < len(sentence):
         yield sentence[nexti:]
 
+
+def __cut(sentence):
+    prob, pos_list = viterbi(sentence, 'BMES', start_P, trans_P, emit_P)
+    return _states_to_words(sentence, pos_list)
+
 re_han = re.compile("([\u4E00-\u9FD5]+)")
 re_skip = re.compile("(\d+\.\d+|[a-zA-Z0-9]+)")
 
 
-def cut(sentence):
-    sentence = strdecode(sentence)
+def _cut_words(sentence):
     blocks = re_han.split(sentence)
     for blk in blocks:
         if re_han.match(blk):
@@ -90,3 +202,76 @@ def cut(sentence):
             for x in tmp:
                 if x:
                     yield x
+
+
+def cut(sentence):
+    check_model_loaded()
+    sentence = strdecode(sentence)
+    cache = _model.cache
+    if cache is None:
+        return _cut_words(sentence)
+    words = cache.get(sentence)
+    if words is None:
+        words = tuple(_cut_words(sentence))
+        cache.put(sentence, words)
+    return iter(words)
+
+
+def cut_batch(sentences):
+    '''
+    The words of each of `sentences` as a list, the same as `cut` gives.
+    The runs of Chinese characters of the sentences not in the cache are
+    decoded together by `viterbi_batch`, each distinct run once, if there
+    are enough of them for numpy to pay off.
+    '''
+    check_model_loaded()
+    sentences = [strdecode(sentence) for sentence in sentences]
+    cache = _model.cache
+    results = [None] * len(sentences)
+    missing = []
+    for i, sentence in enumerate(sentences):
+        words = cache.get(sentence) if cache is not None else None
+        if words is None:
+            missing.append(i)
+        else:
+            results[i] = list(words)
+    if len(missing) < NUMPY_MIN_BATCH or _import_numpy() is None:
+        for i in missing:
+            results[i] = list(_cut_words(sentences[i]))
+    else:
+        for i, words in zip(missing, _cut_batch([sentences[i] for i in missing])):
+            results[i] = words
+    if cache is not None:
+        for i in missing:
+            cache.put(sentences[i], tuple(results[i]))
+    return results
+
+
+def _cut_batch(sentences):
+    runs = []
+    run_index = {}
+    plans = []
+    for sentence in sentences:
+        plan = []
+        for blk in re_han.split(sentence):
+            if re_han.match(blk):
+                i = run_index.get(blk)
+                if i is None:
+                    i = run_index[blk] = len(runs)
+                    runs.append(blk)
+                plan.append(i)
+            else:
+                plan.extend(x for x in re_skip.split(blk) if x)
+        plans.append(plan)
+    run_words = [list(_states_to_words(run, states))
+                 for run, states in zip(runs, viterbi_batch(runs))]
+    results = []
+    for plan in plans:
+        words = []
+        for part in plan:
+            if isinstance(part, int):
+                words.extend(run_words[part])
+            else:
+                words.append(part)
+        results.append(words)
+    return results
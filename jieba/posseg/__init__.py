@@ -5,6 +5,9 @@ import sys
 import jieba
 import pickle
 from .._compat import *
+from .._trie import TrieTags
+from .._profile import timer
+from .. import _tables
 from .viterbi import viterbi
 
 PROB_START_P = "prob_start.p"
@@ -12,6 +15,9 @@ PROB_TRANS_P = "prob_trans.p"
 PROB_EMIT_P = "prob_emit.p"
 CHAR_STATE_TAB_P = "char_state_tab.p"
 
+# file name of the HMM tables inside a directory written by POSTokenizer.publish
+SHARED_MODEL = "posseg.bin"
+
 re_han_detail = re.compile("([\u4E00-\u9FD5]+)")
 re_skip_detail = re.compile("([\.0-9]+|[a-zA-Z0-9]+)")
 re_han_internal = re.compile("([\u4E00-\u9FD5a-zA-Z0-9+#&\._]+)")
@@ -32,13 +38,23 @@ def load_model():
     return state, start_p, trans_p, emit_p
 
 
-if sys.platform.startswith("java"):
-    char_state_tab_P, start_P, trans_P, emit_P = load_model()
-else:
-    from .char_state_tab import P as char_state_tab_P
-    from .prob_start import P as start_P
-    from .prob_trans import P as trans_P
-    from .prob_emit import P as emit_P
+# The tables, loaded on first use, and the cache of the (word, tag) pairs
+# of recently tagged runs of unknown characters, shared by all POSTokenizers
+# (see jieba._tables.Model).
+_model = _tables.Model('posseg', globals(),
+                       ('start_P', 'trans_P', 'emit_P', 'char_state_tab_P'))
+check_model_loaded = _model.check_loaded
+__getattr__ = _model.getattr
+dumps_model = _model.dumps
+attach_model = _model.attach
+set_cache_size = _model.set_cache_size
+cache_info = _model.cache_info
+clear_cache = _model.clear_cache
+discard = _model.discard
+
+
+def set_model(state, start_p, trans_p, emit_p):
+    _model.set(start_p, trans_p, emit_p, state)
 
 
 class pair(object):
@@ -79,7 +95,8 @@ class POSTokenizer(object):
 
     def __init__(self, tokenizer=None):
         self.tokenizer = tokenizer or jieba.Tokenizer()
-        self.load_word_tag(self.tokenizer.get_dict_file())
+        # loaded on first use, see check_word_tag_loaded()
+        self.word_tag_tab = None
 
     def __repr__(self):
         return '<POSTokenizer tokenizer=%r>' % self.tokenizer
@@ -92,8 +109,49 @@ class POSTokenizer(object):
 
     def initialize(self, dictionary=None):
         self.tokenizer.initialize(dictionary)
+        self.word_tag_tab = None
+        self.check_word_tag_loaded()
+
+    def check_word_tag_loaded(self):
+        '''
+        Load the POS tag table. With the "trie" backend the tags stored in
+        the dictionary cache are used in place, else the dictionary is parsed.
+        '''
+        if self.word_tag_tab is not None:
+            return
+        if self.tokenizer.backend == 'trie':
+            self.tokenizer.check_initialized()
+            trie = self.tokenizer.FREQ.trie
+            if trie.has_tags():
+                self.word_tag_tab = TrieTags(trie)
+                return
         self.load_word_tag(self.tokenizer.get_dict_file())
 
+    def publish(self, path):
+        '''
+        Write the loaded dictionary with its POS tags and the HMM tables of
+        `jieba.finalseg` and `jieba.posseg` to the directory `path`, so that
+        other processes can share them with `attach`.
+        '''
+        self.makesure_userdict_loaded()
+        self.tokenizer.publish(path, tags=self.word_tag_tab)
+        jieba._write_file(os.path.join(path, SHARED_MODEL), dumps_model())
+        return path
+
+    def attach(self, path, copy_hmm=False):
+        '''
+        Use the dictionary, POS tags and HMM tables written by `publish` to
+        the directory `path` through read-only memory maps. The HMM tables
+        are module level and thus shared by every POSTokenizer of the
+        process; with `copy_hmm` they are copied into dicts instead, which
+        takes more memory but runs the HMMs about twice as fast.
+        '''
+        self.tokenizer.attach(path, copy_hmm)
+        trie = self.tokenizer.FREQ.trie if self.tokenizer.backend == 'trie' else (
+            jieba.CompactTrie(os.path.join(path, jieba.SHARED_DICT)))
+        self.word_tag_tab = TrieTags(trie)
+        attach_model(os.path.join(path, SHARED_MODEL), copy_hmm)
+
     def load_word_tag(self, f):
         self.word_tag_tab = {}
         f_name = resolve_filename(f)
@@ -110,11 +168,13 @@ class POSTokenizer(object):
         f.close()
 
     def makesure_userdict_loaded(self):
+        self.check_word_tag_loaded()
         if self.tokenizer.user_word_tag_tab:
             self.word_tag_tab.update(self.tokenizer.user_word_tag_tab)
             self.tokenizer.user_word_tag_tab = {}
 
     def __cut(self, sentence):
+        check_model_loaded()
         prob, pos_list = viterbi(
             sentence, char_state_tab_P, start_P, trans_P, emit_P)
         begin, nexti = 0, 0
@@ -149,10 +209,26 @@ class POSTokenizer(object):
                         else:
                             yield pair(x, 'x')
 
-    def __cut_DAG_NO_HMM(self, sentence):
-        DAG = self.tokenizer.get_DAG(sentence)
-        route = {}
-        self.tokenizer.calc(sentence, DAG, route)
+    def __hmm_cut(self, buf):
+        cache = _model.cache
+        if cache is not None:
+            tagged = cache.get(buf)
+            if tagged is not None:
+                # new pairs, which the caller may change
+                return [pair(word, flag) for word, flag in tagged]
+        prof = self.tokenizer.profiler
+        if prof is None:
+            words = list(self.__cut_detail(buf))
+        else:
+            t = timer()
+            words = list(self.__cut_detail(buf))
+            prof.add('pos_hmm', timer() - t, len(buf))
+        if cache is not None:
+            cache.put(buf, tuple((w.word, w.flag) for w in words))
+        return words
+
+    def __cut_DAG_NO_HMM(self, sentence, snap):
+        route = self.tokenizer.get_route(sentence, snap)
         x = 0
         N = len(sentence)
         buf = ''
@@ -172,11 +248,8 @@ class POSTokenizer(object):
             yield pair(buf, 'eng')
             buf = ''
 
-    def __cut_DAG(self, sentence):
-        DAG = self.tokenizer.get_DAG(sentence)
-        route = {}
-
-        self.tokenizer.calc(sentence, DAG, route)
+    def __cut_DAG(self, sentence, snap):
+        route = self.tokenizer.get_route(sentence, snap)
 
         x = 0
         buf = ''
@@ -190,8 +263,8 @@ class POSTokenizer(object):
                 if buf:
                     if len(buf) == 1:
                         yield pair(buf, self.word_tag_tab.get(buf, 'x'))
-                    elif not self.tokenizer.FREQ.get(buf):
-                        recognized = self.__cut_detail(buf)
+                    elif not snap.FREQ.get(buf):
+                        recognized = self.__hmm_cut(buf)
                         for t in recognized:
                             yield t
                     else:
@@ -204,8 +277,8 @@ class POSTokenizer(object):
         if buf:
             if len(buf) == 1:
                 yield pair(buf, self.word_tag_tab.get(buf, 'x'))
-            elif not self.tokenizer.FREQ.get(buf):
-                recognized = self.__cut_detail(buf)
+            elif not snap.FREQ.get(buf):
+                recognized = self.__hmm_cut(buf)
                 for t in recognized:
                     yield t
             else:
@@ -215,29 +288,35 @@ class POSTokenizer(object):
     def __cut_internal(self, sentence, HMM=True):
         self.makesure_userdict_loaded()
         sentence = strdecode(sentence)
-        blocks = re_han_internal.split(sentence)
+        prof = self.tokenizer.profiler
+        if prof is not None:
+            t = timer()
+        spans = jieba.re_scan_default.finditer(sentence)
+        if prof is not None:
+            spans = list(spans)
+            prof.add('split', timer() - t, len(sentence))
         if HMM:
             cut_blk = self.__cut_DAG
         else:
             cut_blk = self.__cut_DAG_NO_HMM
-
-        for blk in blocks:
-            if re_han_internal.match(blk):
-                for word in cut_blk(blk):
+        # the whole sentence is cut with one version of the dictionary, taken
+        # once it is loaded
+        snap = None
+
+        for m in spans:
+            kind = m.lastindex
+            if kind == jieba.SPAN_HAN:
+                if snap is None:
+                    self.tokenizer.check_initialized()
+                    snap = self.tokenizer.snapshot
+                for word in cut_blk(m.group(), snap):
                     yield word
+            elif kind == jieba.SPAN_SKIP:
+                yield pair(m.group(), 'x')
             else:
-                tmp = re_skip_internal.split(blk)
-                for x in tmp:
-                    if re_skip_internal.match(x):
-                        yield pair(x, 'x')
-                    else:
-                        for xx in x:
-                            if re_num.match(xx):
-                                yield pair(xx, 'm')
-                            elif re_eng.match(x):
-                                yield pair(xx, 'eng')
-                            else:
-                                yield pair(xx, 'x')
+                # digits, letters and '.' are all in the blocks cut above
+                for xx in m.group():
+                    yield pair(xx, 'x')
 
     def _lcut_internal(self, sentence):
         return list(self.__cut_internal(sentence))
@@ -252,6 +331,19 @@ class POSTokenizer(object):
     def lcut(self, *args, **kwargs):
         return list(self.cut(*args, **kwargs))
 
+    def enable_profiling(self):
+        '''Profile segmentation, counted together with the wrapped Tokenizer.'''
+        self.tokenizer.enable_profiling()
+
+    def disable_profiling(self):
+        self.tokenizer.disable_profiling()
+
+    def stats(self):
+        return self.tokenizer.stats()
+
+    def reset_stats(self):
+        self.tokenizer.reset_stats()
+
 # default Tokenizer instance
 
 dt = POSTokenizer(jieba.dt)
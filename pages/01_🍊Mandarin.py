@@ -1,5 +1,7 @@
+from array import array
 from collections import Counter
 from dragonmapper import hanzi, transcriptions
+from itertools import accumulate
 import jieba
 import pandas as pd
 import plotly.express as px
@@ -45,18 +47,54 @@ def moedict_caller(word):
     except:
         st.write("查無結果")
             
+# Words from jieba.cut_offsets arrays
+def words_from_offsets(text, starts, ends):
+    return [text[start:end] for start, end in zip(starts, ends)]
+
+# Build a Doc from jieba.cut_offsets arrays, without a tuple per token
+def doc_from_offsets(vocab, text, starts, ends):
+    words = words_from_offsets(text, starts, ends)
+    return Doc(vocab, words=words, spaces=[False] * len(words))
+
+# Offset arrays of words that cover their text, as jieba.cut_offsets gives
+def offsets_from_words(words):
+    ends = array("i", accumulate(map(len, words)))
+    starts = array("i", [0]) + ends[:-1] if ends else array("i")
+    return starts, ends
+
 # Custom tokenizer class
 class JiebaTokenizer:
-    def __init__(self, vocab):
+    def __init__(self, vocab, state=None):
         self.vocab = vocab
+        # keeps the last text and the offsets of its jieba words, e.g. in st.session_state
+        # across reruns; not the Doc, which pipeline components may retokenize in place
+        self.state = state if state is not None else {}
 
     def __call__(self, text):
-        words = jieba.cut(text) # returns a generator
-        tokens = list(words) # convert the genetator to a list
-        spaces = [False] * len(tokens)
-        doc = Doc(self.vocab, words=tokens, spaces=spaces)
+        last = self.state.get("jieba_last")
+        if last:
+            # only re-segment the edited part of the previous text
+            old_text, old_starts, old_ends = last
+            words = jieba.recut(old_text, words_from_offsets(old_text, old_starts, old_ends), text)
+            starts, ends = offsets_from_words(words)
+            doc = Doc(self.vocab, words=words, spaces=[False] * len(words))
+        else:
+            starts, ends = jieba.cut_offsets(text)
+            doc = doc_from_offsets(self.vocab, text, starts, ends)
+        self.state["jieba_last"] = (text, starts, ends)
         return doc
-    
+
+    def pipe(self, texts, batch_size=1000):
+        # segments each batch with jieba.cut_batch, so repeated passages are cut once;
+        # use as nlp.pipe(nlp.tokenizer.pipe(texts))
+        texts = iter(texts)
+        while True:
+            batch = [text for _, text in zip(range(batch_size), texts)]
+            if not batch:
+                break
+            for tokens in jieba.cut_batch(batch):
+                yield Doc(self.vocab, words=tokens, spaces=[False] * len(tokens))
+
 # Utility functions
 def filter_tokens(doc):
     clean_tokens = [tok for tok in doc if tok.pos_ not in PUNCT_SYM]
@@ -119,7 +157,9 @@ st.set_page_config(
 )
 st.markdown(f"# {DESCRIPTION}") 
 
-# Load the model
+# Load the model, with the jieba dictionary loading alongside
+# (a no-op if app.py has already started it)
+jieba.initialize(background=True)
 nlp = spacy.load(MODEL_NAME)
           
 # Add pipelines to spaCy
@@ -129,7 +169,12 @@ nlp = spacy.load(MODEL_NAME)
 # Select a tokenizer if the Chinese model is chosen
 selected_tokenizer = st.radio("請選擇斷詞模型", ["jieba-TW", "spaCy"])
 if selected_tokenizer == "jieba-TW":
-    nlp.tokenizer = JiebaTokenizer(nlp.vocab)
+    if not jieba.dt.initialized:
+        progress_bar = st.progress(0)
+        while not jieba.wait_initialized(timeout=0.2):
+            progress_bar.progress(int(jieba.dt.init_progress * 100))
+        progress_bar.empty()
+    nlp.tokenizer = JiebaTokenizer(nlp.vocab, st.session_state)
 
 # Page starts from here
 st.markdown("## 待分析文本")     